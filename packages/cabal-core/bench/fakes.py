@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+import zlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.retrievers import BaseRetriever
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A local stand-in for `ChatBedrockConverse`.
+
+    Streams list-shaped Converse-style content blocks with a configurable delay
+    per token. A configurable share of user messages (picked deterministically
+    by hashing the message) first get a `query_nod_archives` tool call; once
+    the tool result comes back, the model streams its answer.
+    """
+
+    first_token_delay_seconds: float = 0.3
+    token_delay_seconds: float = 0.02
+    answer_tokens: int = 80
+    tool_call_ratio: float = 1.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-bedrock-converse"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _should_call_tool(self, messages: List[BaseMessage]) -> bool:
+        last_message = messages[-1]
+        if isinstance(last_message, ToolMessage) or not isinstance(last_message, HumanMessage):
+            return False
+        bucket = zlib.crc32(str(last_message.content).encode("utf-8")) % 1000
+        return bucket < self.tool_call_ratio * 1000
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[AIMessageChunk]:
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+
+        if self._should_call_tool(messages):
+            yield AIMessageChunk(
+                content=[],
+                tool_call_chunks=[{
+                    "name": "query_nod_archives",
+                    "args": json.dumps({"query": str(messages[-1].content)}),
+                    "id": f"tooluse_{zlib.crc32(str(messages[-1].content).encode('utf-8'))}",
+                    "index": 0,
+                }],
+                usage_metadata={"input_tokens": input_tokens, "output_tokens": 20, "total_tokens": input_tokens + 20},
+            )
+            return
+
+        for i in range(self.answer_tokens):
+            yield AIMessageChunk(content=[{"type": "text", "text": f"token{i} ", "index": 0}])
+        yield AIMessageChunk(
+            content=[],
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": self.answer_tokens,
+                "total_tokens": input_tokens + self.answer_tokens,
+            },
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = None
+        for chunk in self._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            message = chunk.message if message is None else message + chunk.message
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_delay_seconds)
+        for chunk in self._chunks(messages):
+            yield ChatGenerationChunk(message=chunk)
+            time.sleep(self.token_delay_seconds)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_delay_seconds)
+        for chunk in self._chunks(messages):
+            yield ChatGenerationChunk(message=chunk)
+            await asyncio.sleep(self.token_delay_seconds)
+
+
+class FakeArchiveRetriever(BaseRetriever):
+    """
+    A local stand-in for `AmazonKnowledgeBasesRetriever`.
+
+    Blocks for `latency_seconds` (just like boto3's Retrieve call would) and
+    returns `k` synthetic passages of roughly `passage_chars` characters.
+    """
+
+    latency_seconds: float = 0.3
+    k: int = 5
+    passage_chars: int = 1200
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        time.sleep(self.latency_seconds)
+        filler = "The Brotherhood of Nod archives record the following. " * (self.passage_chars // 54 + 1)
+        return [
+            Document(
+                page_content=f"Passage {i} for '{query}'. {filler[:self.passage_chars]}",
+                metadata={"score": 1.0 - i / 10},
+            )
+            for i in range(self.k)
+        ]
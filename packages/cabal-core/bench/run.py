@@ -0,0 +1,192 @@
+"""
+Offline load test for cabal-core.
+
+Serves the real FastAPI `app` with uvicorn on localhost, with local stand-ins
+for the Bedrock model and the Nod Archives KB (see fakes.py), then drives
+/chat with many concurrent SSE clients. No network access or AWS credentials
+are needed.
+
+Usage (from packages/cabal-core):
+
+    pip install -r bench/requirements.txt
+    python bench/run.py --clients 50 --requests 200 --kb-latency-ms 300
+
+Any CABAL_* / NOD_ARCHIVES_* environment variables are honoured, so the same
+run can be repeated with e.g. CABAL_STREAM_COALESCE_WINDOW_SECONDS=0 to
+compare configurations.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# cabal reads these at import time; none of them are used to reach AWS here
+os.environ.setdefault("MODEL_ID", "us.anthropic.claude-3-5-haiku-20241022-v1:0")
+os.environ.setdefault("KNOWLEDGE_BASE_ID", "BENCHMARK")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["CABAL_STARTUP_MODE"] = "lazy"
+# The fake KB has no ingestion jobs to check for new syncs
+os.environ["NOD_ARCHIVES_CACHE_REFRESH_SECONDS"] = "0"
+
+import httpx
+import uvicorn
+from fakes import FakeArchiveRetriever, FakeChatModel
+
+
+def install_fakes(args: argparse.Namespace) -> Any:
+    """
+    Imports the app and swaps the Bedrock model and KB retriever for fakes.
+    """
+    import cabal
+
+    cabal.create_llm = lambda: FakeChatModel(
+        first_token_delay_seconds=args.first_token_delay_ms / 1000,
+        token_delay_seconds=args.token_delay_ms / 1000,
+        answer_tokens=args.answer_tokens,
+        tool_call_ratio=args.tool_call_ratio,
+    )
+    cabal.get_agent()
+
+    archives = sys.modules["tools.query_nod_archives"]
+    archives.kb_retriever = FakeArchiveRetriever(latency_seconds=args.kb_latency_ms / 1000)
+    return cabal.app
+
+
+def start_server(app: Any) -> str:
+    """
+    Serves the app from a background thread, like a separate worker would.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def run_stream(client: httpx.AsyncClient, url: str, message: str) -> Dict[str, Any]:
+    """
+    Sends one /chat request and times its SSE stream.
+    """
+    started_at = time.perf_counter()
+    result: Dict[str, Any] = {"ttft": None, "total": None, "frames": 0, "bytes": 0, "error": None}
+
+    try:
+        async with client.stream("POST", f"{url}/chat", json={"message": message}) as response:
+            async for line in response.aiter_lines():
+                result["bytes"] += len(line) + 1
+                if not line.startswith("event: "):
+                    continue
+                result["frames"] += 1
+                event = line.removeprefix("event: ")
+                if event == "message" and result["ttft"] is None:
+                    result["ttft"] = time.perf_counter() - started_at
+                elif event == "error":
+                    result["error"] = "error event"
+                elif event == "done":
+                    result["total"] = time.perf_counter() - started_at
+    except httpx.HTTPError as e:
+        result["error"] = str(e)
+
+    return result
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float, args: argparse.Namespace) -> Dict[str, Any]:
+    ttfts = [r["ttft"] * 1000 for r in results if r["ttft"] is not None]
+    totals = [r["total"] * 1000 for r in results if r["total"] is not None]
+    completed = len(totals)
+
+    def stats(values: List[float]) -> Dict[str, Optional[float]]:
+        return {
+            "mean": round(statistics.fmean(values), 1) if values else None,
+            **{f"p{p}": round(percentile(values, p), 1) if values else None for p in (50, 95, 99)},
+        }
+
+    return {
+        "requests": len(results),
+        "completed": completed,
+        "errors": sum(1 for r in results if r["error"]),
+        "clients": args.clients,
+        "wall_seconds": round(wall_seconds, 2),
+        "requests_per_second": round(completed / wall_seconds, 2),
+        "tokens_per_second": round(completed * args.answer_tokens / wall_seconds, 1),
+        "frames_per_stream": round(statistics.fmean(r["frames"] for r in results), 1),
+        "ttft_ms": stats(ttfts),
+        "completion_ms": stats(totals),
+    }
+
+
+async def run_benchmark(url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(args.clients)
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        async def bounded(i: int) -> Dict[str, Any]:
+            async with semaphore:
+                # Unique messages by default, so retrieval and response caches don't flatter the numbers
+                suffix = f" (request {i})" if not args.repeat_messages else ""
+                return await run_stream(client, url, f"{args.message}{suffix}")
+
+        started_at = time.perf_counter()
+        results = await asyncio.gather(*[bounded(i) for i in range(args.requests)])
+        return summarize(results, time.perf_counter() - started_at, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline /chat load test with fake Bedrock services.")
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent SSE clients")
+    parser.add_argument("--requests", type=int, default=100, help="Total /chat requests")
+    parser.add_argument("--message", default="Tell me about the Cyborg Commando")
+    parser.add_argument("--repeat-messages", action="store_true", help="Send the exact same message every time")
+    parser.add_argument("--first-token-delay-ms", type=float, default=300, help="Fake model latency per turn")
+    parser.add_argument("--token-delay-ms", type=float, default=20, help="Fake model delay per token")
+    parser.add_argument("--answer-tokens", type=int, default=80, help="Tokens per fake answer")
+    parser.add_argument("--tool-call-ratio", type=float, default=1.0, help="Share of requests that call the KB")
+    parser.add_argument("--kb-latency-ms", type=float, default=300, help="Fake KB Retrieve latency")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure peak memory per stream (slower)")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON only")
+    args = parser.parse_args()
+
+    url = start_server(install_fakes(args))
+
+    if args.trace_memory:
+        tracemalloc.start()
+        baseline_bytes = tracemalloc.get_traced_memory()[0]
+
+    # The app logs EMF metrics for every request; keep them out of our report
+    with contextlib.redirect_stdout(sys.stderr):
+        summary = asyncio.run(run_benchmark(url, args))
+
+    if args.trace_memory:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # Client and server share this process, so this is an upper bound per stream
+        summary["peak_kib_per_stream"] = round((peak_bytes - baseline_bytes) / 1024 / min(args.clients, args.requests), 1)
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print("[CABAL Benchmark]")
+        print(json.dumps(summary, indent=2))
@@ -1,24 +1,117 @@
+import io
 import os
-import boto3
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+import json
+import time
+import asyncio
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from langchain_aws import ChatBedrockConverse
-from langchain.agents import create_agent
-from prompts import operational_voice_system_prompt, narrative_voice_system_prompt
-from tools import query_nod_archives
-from utils import format_sse, SSEEventType
-
-# Create client for interfacing with our Bedrock model
-llm = ChatBedrockConverse(
-    model_id=os.environ["MODEL_ID"],
-    client=boto3.client("bedrock-runtime"),
-    temperature=0.0,
-    max_tokens=2048
+from prompts import operational_voice_system_prompt, narrative_voice_system_prompt, PersonaIndex
+from utils import (
+    encode_sse,
+    estimate_tokens,
+    extract_text,
+    coalesce_events,
+    SSEEventType,
+    ResponseCache,
+    replay_events,
+    RequestMetrics,
+    ClientDisconnected,
+    wait_for_disconnect,
+    until_disconnected,
+    AdmissionController,
+    StreamBuffer,
+    StreamRegistry,
+    StreamGap,
+    get_client,
+    drain_client_metrics,
+    drain_cache_metrics,
+    SessionStore,
+    window_history,
+    summarize_turns,
+    parse_batch_line,
+    bounded_map,
 )
 
-# List of tools
-tools = [query_nod_archives]
+# When to build the agent (and import langchain, boto3, etc.):
+# - "eager": at import time, before uvicorn starts serving
+# - "background": on a background thread as soon as the app starts up
+# - "lazy": on the first request that needs it (or the /ready warm-up hook)
+CABAL_STARTUP_MODE = os.environ.get("CABAL_STARTUP_MODE", "eager")
+
+# "full" sends both voice prompts in their entirety on every request. "slim" sends
+# the base instruction plus only the voice prompt sections (quote categories and
+# mission excerpts) most relevant to the user's message, within a token budget.
+CABAL_PERSONA_MODE = os.environ.get("CABAL_PERSONA_MODE", "full")
+CABAL_PERSONA_MAX_SECTIONS = int(os.environ.get("CABAL_PERSONA_MAX_SECTIONS", "4"))
+CABAL_PERSONA_MAX_TOKENS = int(os.environ.get("CABAL_PERSONA_MAX_TOKENS", "1200"))
+
+# Whether to mark the static persona prompt as a Bedrock prompt cache checkpoint.
+# Bedrock won't cache a prefix shorter than the model's minimum (2048 tokens for
+# Claude 3.5 Haiku, 1024 for most others), so we skip the checkpoint for prompts
+# estimated to be shorter than this, e.g. the base instruction alone in slim mode.
+CABAL_PROMPT_CACHE_ENABLED = os.environ.get("CABAL_PROMPT_CACHE_ENABLED", "true") == "true"
+CABAL_PROMPT_CACHE_MIN_TOKENS = int(os.environ.get("CABAL_PROMPT_CACHE_MIN_TOKENS", "2048"))
+
+# Max number of agent runs in flight per worker (0 for no limit). Requests over
+# the limit queue for up to the given timeout, or are rejected straight away if
+# the timeout is 0.
+CABAL_MAX_CONCURRENT_RUNS = int(os.environ.get("CABAL_MAX_CONCURRENT_RUNS", "0"))
+CABAL_ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("CABAL_ADMISSION_QUEUE_TIMEOUT_SECONDS", "5"))
+
+# Whether to send the request's metrics to the client as a 'METRICS' SSE.
+# Metrics are always logged to CloudWatch either way.
+CABAL_METRICS_EVENT_ENABLED = os.environ.get("CABAL_METRICS_EVENT_ENABLED", "false") == "true"
+
+# Streamed message chunks are coalesced for up to this long (0 disables coalescing),
+# or until this many bytes are buffered. The first chunk is always sent immediately.
+CABAL_STREAM_COALESCE_WINDOW_SECONDS = float(os.environ.get("CABAL_STREAM_COALESCE_WINDOW_SECONDS", "0.03"))
+CABAL_STREAM_COALESCE_MAX_BYTES = int(os.environ.get("CABAL_STREAM_COALESCE_MAX_BYTES", "1024"))
+
+# Whether to start a Nod archives lookup for the user's message in parallel with
+# the agent's first model turn, when the message looks like a lore question
+CABAL_PREFETCH_ENABLED = os.environ.get("CABAL_PREFETCH_ENABLED", "false") == "true"
+
+# Resumable streams. A run's SSEs are buffered for a while, so a client that drops
+# off can reconnect with the `Last-Event-ID` header and only get what it missed.
+# With nobody listening, the run itself keeps going for up to the grace period
+# before it's cancelled, and finished streams stay resumable for the TTL.
+CABAL_STREAM_RESUME_ENABLED = os.environ.get("CABAL_STREAM_RESUME_ENABLED", "false") == "true"
+CABAL_STREAM_RESUME_BUFFER_EVENTS = int(os.environ.get("CABAL_STREAM_RESUME_BUFFER_EVENTS", "512"))
+CABAL_STREAM_RESUME_GRACE_SECONDS = float(os.environ.get("CABAL_STREAM_RESUME_GRACE_SECONDS", "15"))
+CABAL_STREAM_RESUME_TTL_SECONDS = float(os.environ.get("CABAL_STREAM_RESUME_TTL_SECONDS", "60"))
+CABAL_STREAM_RESUME_MAX_STREAMS = int(os.environ.get("CABAL_STREAM_RESUME_MAX_STREAMS", "256"))
+
+# Multi-turn sessions, for requests that carry a `session_id`. Histories are kept
+# compact (messages and answers only) and capped per session, per worker and by
+# age. Only the most recent exchanges that fit the token budget are sent to the
+# model; older ones are boiled down to a one-line summary.
+CABAL_SESSION_MAX_SESSIONS = int(os.environ.get("CABAL_SESSION_MAX_SESSIONS", "1000"))
+CABAL_SESSION_MAX_BYTES = int(os.environ.get("CABAL_SESSION_MAX_BYTES", str(16 * 1024 * 1024)))
+CABAL_SESSION_MAX_TURNS = int(os.environ.get("CABAL_SESSION_MAX_TURNS", "40"))
+CABAL_SESSION_TTL_SECONDS = float(os.environ.get("CABAL_SESSION_TTL_SECONDS", "3600"))
+CABAL_SESSION_DB_PATH = os.environ.get("CABAL_SESSION_DB_PATH")
+CABAL_SESSION_HISTORY_MAX_TOKENS = int(os.environ.get("CABAL_SESSION_HISTORY_MAX_TOKENS", "2000"))
+
+# Batch evaluation (/chat/batch). Callers can ask for less concurrency or a shorter
+# per-prompt timeout than these, but not more.
+CABAL_BATCH_MAX_CONCURRENCY = int(os.environ.get("CABAL_BATCH_MAX_CONCURRENCY", "4"))
+CABAL_BATCH_ITEM_TIMEOUT_SECONDS = float(os.environ.get("CABAL_BATCH_ITEM_TIMEOUT_SECONDS", "120"))
+
+# Opt-in cache of full responses for repeat messages (see `ResponseCache`)
+CABAL_RESPONSE_CACHE_ENABLED = os.environ.get("CABAL_RESPONSE_CACHE_ENABLED", "false") == "true"
+CABAL_RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("CABAL_RESPONSE_CACHE_MAX_ENTRIES", "512"))
+CABAL_RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("CABAL_RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+CABAL_RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("CABAL_RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+# Pacing of replayed responses. A chunk size of 0 replays the answer in one go.
+CABAL_RESPONSE_CACHE_REPLAY_CHUNK_CHARS = int(os.environ.get("CABAL_RESPONSE_CACHE_REPLAY_CHUNK_CHARS", "24"))
+CABAL_RESPONSE_CACHE_REPLAY_DELAY_SECONDS = float(os.environ.get("CABAL_RESPONSE_CACHE_REPLAY_DELAY_SECONDS", "0.02"))
 
 # Configure CABAL persona for agent
 base_instruction = """
@@ -46,65 +139,499 @@ As an AI agent:
 """
 
 def construct_system_prompt():
+    # In slim mode, voice prompt sections are added per request instead (see
+    # `create_persona_middleware`)
+    if CABAL_PERSONA_MODE == "slim":
+        return base_instruction
+
     return f"""
     {base_instruction}
     {operational_voice_system_prompt}
     {narrative_voice_system_prompt}
     """
 
+def construct_system_message(system_prompt: str, persona_excerpts: str = ""):
+    """
+    Wraps the system prompt in a message for the agent.
+
+    The persona prompt is thousands of tokens long and identical on every
+    request, so we follow it with a Bedrock cache checkpoint. Bedrock then
+    caches the whole prefix up to that point (tool definitions included)
+    instead of re-processing it on every model turn.
+
+    In slim mode, the static part is just the base instruction, which is
+    too short to cache, so there's no checkpoint and slim mode gives up
+    prompt caching. Per-request persona excerpts always go last, so they'd
+    never invalidate a cached prefix.
+    """
+    from langchain_aws import ChatBedrockConverse
+    from langchain_core.messages import SystemMessage
+
+    content = [{"type": "text", "text": system_prompt}]
+    if CABAL_PROMPT_CACHE_ENABLED and estimate_tokens(system_prompt) >= CABAL_PROMPT_CACHE_MIN_TOKENS:
+        content.append(ChatBedrockConverse.create_cache_point())
+    if persona_excerpts:
+        content.append({"type": "text", "text": persona_excerpts})
+    return SystemMessage(content=content)
+
+@lru_cache(maxsize=256)
+def select_persona_excerpts(message: str) -> str:
+    """
+    Returns the voice prompt sections most relevant to a message, as prompt text.
+    """
+    sections = persona_index.select(
+        message,
+        max_sections=CABAL_PERSONA_MAX_SECTIONS,
+        max_tokens=CABAL_PERSONA_MAX_TOKENS,
+    )
+    return persona_index.render(sections)
+
+def create_persona_middleware():
+    """
+    Returns agent middleware which adds the voice prompt sections relevant to
+    the user's latest message to the system prompt, on every model call.
+    """
+    from langchain.agents.middleware import dynamic_prompt
+    from langchain_core.messages import HumanMessage
+
+    @dynamic_prompt
+    def slim_persona(request):
+        message = next((m for m in reversed(request.messages) if isinstance(m, HumanMessage)), None)
+        excerpts = select_persona_excerpts(extract_text(message.content) if message else "")
+        return construct_system_message(system_prompt, persona_excerpts=excerpts)
+
+    return slim_persona
+
+def create_llm():
+    """
+    Creates the client for interfacing with our Bedrock model.
+    """
+    from langchain_aws import ChatBedrockConverse
+
+    return ChatBedrockConverse(
+        model_id=os.environ["MODEL_ID"],
+        client=get_client("bedrock-runtime"),
+        temperature=0.0,
+        max_tokens=2048
+    )
+
+def load_tools():
+    """
+    Returns the list of tools. Importing the tools module builds the KB retriever.
+    """
+    from tools import query_nod_archives
+
+    return [query_nod_archives]
+
+def build_agent():
+    """
+    Builds the CABAL agent.
+
+    Langchain, boto3 and their clients make up most of our cold start, so
+    all of their imports live in here rather than at the top of the module.
+    """
+    # The model client and the tools (i.e. the KB retriever) don't depend on
+    # each other, so we build them side by side
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        tools_future = executor.submit(load_tools)
+        llm = create_llm()
+        tools = tools_future.result()
+
+    from langchain.agents import create_agent
+
+    return create_agent(
+        llm,
+        tools,
+        system_prompt=construct_system_message(system_prompt),
+        middleware=[create_persona_middleware()] if persona_index else [],
+    )
+
+# The agent is built at most once per worker, by whichever caller gets here first
+agent = None
+agent_lock = threading.Lock()
+
+def get_agent():
+    global agent
+    with agent_lock:
+        if agent is None:
+            agent = build_agent()
+    return agent
+
+async def aget_agent():
+    """
+    Returns the agent, building it off the event loop if it isn't ready yet.
+    """
+    if agent is not None:
+        return agent
+    return await asyncio.to_thread(get_agent)
+
 # Instantiate agent 
-agent = create_agent(llm, tools, system_prompt=construct_system_prompt())
+system_prompt = construct_system_prompt()
+
+# In slim mode, the voice prompts are split into sections and indexed up front
+persona_index = PersonaIndex({
+    "operational": operational_voice_system_prompt,
+    "narrative": narrative_voice_system_prompt,
+}) if CABAL_PERSONA_MODE == "slim" else None
+
+if CABAL_STARTUP_MODE == "eager":
+    get_agent()
+
+# Instantiate response cache, if enabled. In slim mode the prompt depends on the
+# message, but only through the voice prompts and the selection settings, so
+# those are what cached responses are tied to.
+response_cache = ResponseCache(
+    model_id=os.environ["MODEL_ID"],
+    system_prompt=system_prompt if not persona_index else "\x1f".join([
+        system_prompt,
+        operational_voice_system_prompt,
+        narrative_voice_system_prompt,
+        f"slim:{CABAL_PERSONA_MAX_SECTIONS}:{CABAL_PERSONA_MAX_TOKENS}",
+    ]),
+    max_entries=CABAL_RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=CABAL_RESPONSE_CACHE_MAX_BYTES,
+    ttl_seconds=CABAL_RESPONSE_CACHE_TTL_SECONDS,
+) if CABAL_RESPONSE_CACHE_ENABLED else None
+
+# Instantiate store of chat session histories
+session_store = SessionStore(
+    max_sessions=CABAL_SESSION_MAX_SESSIONS,
+    max_bytes=CABAL_SESSION_MAX_BYTES,
+    max_turns=CABAL_SESSION_MAX_TURNS,
+    ttl_seconds=CABAL_SESSION_TTL_SECONDS,
+    db_path=CABAL_SESSION_DB_PATH,
+)
+
+# Instantiate registry of resumable streams
+stream_registry = StreamRegistry(
+    max_events=CABAL_STREAM_RESUME_BUFFER_EVENTS,
+    max_streams=CABAL_STREAM_RESUME_MAX_STREAMS,
+    ttl_seconds=CABAL_STREAM_RESUME_TTL_SECONDS,
+) if CABAL_STREAM_RESUME_ENABLED else None
+
+STREAM_LOST_MESSAGE = "Transmission lost and no longer recoverable. Resubmit your request, Commander."
+
+# Instantiate admission controller for agent runs
+admission = AdmissionController(
+    max_concurrent=CABAL_MAX_CONCURRENT_RUNS,
+    queue_timeout_seconds=CABAL_ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # In background mode we start building the agent while uvicorn finishes
+    # booting, so the work overlaps with the Lambda Web Adapter's readiness checks
+    if CABAL_STARTUP_MODE == "background":
+        threading.Thread(target=get_agent, name="cabal-startup", daemon=True).start()
+    yield
 
 # Instantiate FastAPI app
-app = FastAPI(title="CABAL Core", version="0.1.0")
+app = FastAPI(title="CABAL Core", version="0.1.0", lifespan=lifespan)
+
+# Set up FastAPI readiness endpoint
+@app.get("/ready")
+async def ready():
+    """
+    Readiness and warm-up hook. Point the Lambda Web Adapter's readiness check
+    (AWS_LWA_READINESS_CHECK_PATH) here so the agent is built before the first
+    request is routed to this worker.
+    """
+    try:
+        await aget_agent()
+    except Exception as e:
+        print(f"CABAL Exception: {str(e)}")
+        return JSONResponse({"status": "offline"}, status_code=503)
+    return {"status": "ready"}
 
 # Define FastAPI request model
 class ChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = None
 
-# Set up FastAPI chat endpoint handler
-@app.post("/chat")
-async def chat(request: ChatRequest):
+async def run_agent(
+    agent,
+    user_message: str,
+    metrics: RequestMetrics,
+    stream: StreamBuffer,
+    cache_key=None,
+    session_id: Optional[str] = None,
+    history: Optional[List] = None,
+):
     """
-    CABAL chat endpoint that streams responses using Server-Sent Events (SSE).
+    Runs the agent on a single message (following on from the session's
+    `history`, if any) and appends its SSEs to `stream`.
+
+    This runs as a task of its own rather than inside the response, so that it
+    can outlive a dropped connection (see `StreamBuffer.release`).
     """
-    async def generate_stream():
-        try:
-            user_message = request.message
-            
-            if not user_message:
-                yield format_sse("No message provided.", event=SSEEventType.ERROR)
-                return
-            
-            # TODO: May need to replace this with message history when we 
-            # implement chat sessions
-            inputs = {"messages": [("user", user_message)]}
-            
-            # We surface live feedback from langchain agent as it runs. This feedback
-            # can comprise different event types (chat chunk, tool use, etc).
+    prefetch = None
+
+    # We record every event we emit so a complete response can be cached
+    recorded_events = []
+
+    def emit(data, event):
+        recorded_events.append((event, data))
+        stream.append(data, event=event)
+
+    try:
+        # Speculatively look up the message in the archives while the model works
+        # out its first turn. If it then calls the archives tool with a similar
+        # query, the tool awaits this lookup rather than starting from scratch.
+        if CABAL_PREFETCH_ENABLED:
+            from retrieval import active_prefetch, looks_like_archive_question
+            from tools import prefetch_nod_archives
+
+            if looks_like_archive_question(user_message):
+                # The run has a context of its own, so there's no need to reset it afterwards
+                prefetch = prefetch_nod_archives(user_message)
+                active_prefetch.set(prefetch)
+
+        # Only the latest exchanges that fit the budget are sent along, so requests
+        # stop growing with the length of the conversation
+        window, dropped = window_history(history or [], CABAL_SESSION_HISTORY_MAX_TOKENS)
+        messages = [*window, ("user", user_message)]
+        summary = summarize_turns(dropped)
+        if summary:
+            messages[0] = ("user", f"{summary}\n\n{messages[0][1]}")
+        if session_id:
+            metrics.observe_history(window, dropped)
+
+        inputs = {"messages": messages}
+        
+        # We surface live feedback from langchain agent as it runs. This feedback
+        # can comprise different event types (chat chunk, tool use, etc).
+        async def agent_events():
             async for event in agent.astream_events(input=inputs, version="v2"):
+                metrics.observe(event)
+
                 # 1. Chat events
                 if event["event"] == "on_chat_model_stream":
                     chunk = event["data"]["chunk"]
-                    if hasattr(chunk, 'content') and chunk.content:
+                    text = extract_text(getattr(chunk, "content", None))
+                    if text:
+                        metrics.mark_first_token()
                         # Yield chat events as 'MESSAGE' SSEs
-                        yield format_sse(chunk.content, event=SSEEventType.MESSAGE)
-                
+                        yield SSEEventType.MESSAGE, text
+
                 # 2. Tool events
                 elif event["event"] == "on_tool_start":
                     tool_name = event.get("name", "UNKNOWN_PROGRAM")
                     # Yield tool events as 'TOOL' SSEs
-                    yield format_sse(
+                    yield (
+                        SSEEventType.TOOL,
                         f"[Accessing CABAL subroutine: {tool_name.upper()}...]",
-                        event=SSEEventType.TOOL
                     )
-                
-            # 3. Yield 'DONE' event SSE event type when stream completes
-            yield format_sse("", event=SSEEventType.DONE)
+
+        # Message chunks are batched into fewer, larger SSEs on their way out
+        async for event_type, data in coalesce_events(
+            agent_events(),
+            window_seconds=CABAL_STREAM_COALESCE_WINDOW_SECONDS,
+            max_bytes=CABAL_STREAM_COALESCE_MAX_BYTES,
+        ):
+            emit(data, event=event_type)
+
+        if prefetch:
+            prefetch.close()
+            metrics.prefetch_outcome = prefetch.outcome
+
+        if session_id:
+            answer = "".join(data for event, data in recorded_events if event == SSEEventType.MESSAGE)
+            await record_exchange(session_id, user_message, answer, metrics)
+
+        metrics.finish()
+        log_metrics(metrics)
+
+        # Only responses that ran to completion, with every tool call going
+        # through in full, are cached; an answer written while the archives were
+        # down (or only partly answering) shouldn't be replayed to everyone
+        # asking the same question. We store them before appending 'DONE' since
+        # the client may hang up as soon as it sees it.
+        recorded_events.append((SSEEventType.DONE, ""))
+        if cache_key and not metrics.tool_failed:
+            response_cache.set(cache_key, recorded_events)
+
+        # Metrics are specific to this run, so they're never recorded for replay
+        if CABAL_METRICS_EVENT_ENABLED:
+            stream.append(metrics.as_dict(), event=SSEEventType.METRICS)
+
+        # 3. Append 'DONE' event SSE event type when the run completes
+        stream.append("", event=SSEEventType.DONE)
+
+    except asyncio.CancelledError:
+        # Nobody has been listening for a while, so the run was called off
+        metrics.disconnected = True
+        metrics.finish()
+        log_metrics(metrics)
+        raise
+
+    except Exception as e:
+        print(f"CABAL Exception: {str(e)}")
+        stream.append(f"System failure: {str(e)}", event=SSEEventType.ERROR)
+
+    finally:
+        if prefetch:
+            prefetch.close()
+
+def log_metrics(metrics: RequestMetrics):
+    """
+    Logs a run's metrics, and the AWS client latencies and cache counters
+    since the last run, as single JSON lines so CloudWatch picks them up as
+    EMF metrics.
+    """
+    print(json.dumps(metrics.to_emf()))
+    for record in [*drain_client_metrics(), *drain_cache_metrics()]:
+        print(json.dumps(record))
+
+async def load_history(session_id: str) -> List:
+    """
+    Returns a session's history. Sessions still in memory are read straight
+    from the loop; with a persistent tier, anything else may come from
+    SQLite, so it's read on a thread.
+    """
+    history = session_store.get_memory(session_id)
+    if history is not None:
+        return history
+    if session_store.persistent:
+        return await asyncio.to_thread(session_store.get, session_id)
+    return session_store.get(session_id)
+
+async def record_exchange(session_id: str, user_message: str, answer: str, metrics: Optional[RequestMetrics] = None):
+    """
+    Adds a completed exchange to the session's history.
+    """
+    # Bedrock rejects empty assistant turns, and there's nothing to follow on from anyway
+    if not answer:
+        return
+
+    # With a persistent tier, appending reads and commits to SQLite, so it runs on a thread
+    turns = [("user", user_message), ("assistant", answer)]
+    if session_store.persistent:
+        evictions = await asyncio.to_thread(session_store.append, session_id, turns)
+    else:
+        evictions = session_store.append(session_id, turns)
+    if metrics:
+        metrics.session_evictions = evictions
+        metrics.session_store_bytes = session_store.stats()["bytes"]
+
+# Set up FastAPI chat endpoint handler
+@app.post("/chat")
+async def chat(request: ChatRequest, http_request: Request):
+    """
+    CABAL chat endpoint that streams responses using Server-Sent Events (SSE).
+
+    Clients that lose the stream can send the same request again with the
+    `Last-Event-ID` header to receive only the events they missed, as long as
+    stream resumption is enabled and the stream is still buffered.
+    """
+    async def generate_stream():
+        metrics = RequestMetrics()
+        admitted = False
+        stream = None
+
+        # Resolves once the client hangs up, so we can stop paying for the run
+        disconnected = asyncio.ensure_future(wait_for_disconnect(http_request.receive))
+
+        try:
+            # Reconnecting clients pick up where they dropped off, without re-running the agent
+            last_event_id = http_request.headers.get("last-event-id")
+            if last_event_id and stream_registry:
+                stream, after = stream_registry.resolve(last_event_id)
+                if stream is None:
+                    yield encode_sse(STREAM_LOST_MESSAGE, event=SSEEventType.ERROR)
+                    return
+                async for sse in until_disconnected(stream.tail(after), disconnected):
+                    yield sse
+                return
+
+            user_message = request.message
+            
+            if not user_message:
+                yield encode_sse("No message provided.", event=SSEEventType.ERROR)
+                return
+
+            session_id = request.session_id
+            history = await load_history(session_id) if session_id else []
+
+            # Replay a cached response for repeat messages, skipping the agent entirely.
+            # Follow-up messages depend on what came before, so they're never cached.
+            cache_key = response_cache.key(user_message) if response_cache and not history else None
+            cached_events = response_cache.get(cache_key) if cache_key else None
+            if cached_events:
+                if session_id:
+                    answer = "".join(data for event, data in cached_events if event == SSEEventType.MESSAGE)
+                    await record_exchange(session_id, user_message, answer)
+                async for event, data in replay_events(
+                    cached_events,
+                    chunk_chars=CABAL_RESPONSE_CACHE_REPLAY_CHUNK_CHARS,
+                    delay_seconds=CABAL_RESPONSE_CACHE_REPLAY_DELAY_SECONDS,
+                ):
+                    yield encode_sse(data, event=event)
+                return
+
+            # Wait for a free slot, or fail fast if this worker is saturated
+            queued_at = time.perf_counter()
+            admitted = await admission.acquire()
+            metrics.queue_seconds = time.perf_counter() - queued_at
+            if not admitted:
+                print(f"CABAL Rejected: {json.dumps(admission.stats())}")
+                yield encode_sse(
+                    "CABAL core at capacity. Resubmit your request shortly, Commander.",
+                    event=SSEEventType.ERROR,
+                )
+                return
+
+            agent = await aget_agent()
+
+            # Without resumption, evicted events could never be recovered, so
+            # the buffer only has to hold the run for its one live reader
+            stream = (
+                stream_registry.create() if stream_registry
+                else StreamBuffer()
+            )
+
+            # From here on the run owns the admission slot. We release it (and close
+            # the stream) in a callback, which still fires if the task is cancelled
+            # before it even starts.
+            def on_run_done(_):
+                stream.finish()
+                admission.release()
+
+            stream.producer = asyncio.create_task(
+                run_agent(
+                    agent,
+                    user_message,
+                    metrics,
+                    stream,
+                    cache_key=cache_key,
+                    session_id=session_id,
+                    history=history,
+                )
+            )
+            stream.producer.add_done_callback(on_run_done)
+            admitted = False
+
+            # If the client hangs up, the run is cancelled (once the resume grace
+            # period is up), along with any in-flight model turn or tool call
+            async for sse in until_disconnected(stream.tail(), disconnected):
+                yield sse
+
+        except ClientDisconnected:
+            # Nobody is listening anymore, so there's nothing left to yield
+            pass
+
+        except StreamGap:
+            yield encode_sse(STREAM_LOST_MESSAGE, event=SSEEventType.ERROR)
         
         except Exception as e:
             print(f"CABAL Exception: {str(e)}")
-            yield format_sse(f"System failure: {str(e)}", event=SSEEventType.ERROR)
+            yield encode_sse(f"System failure: {str(e)}", event=SSEEventType.ERROR)
+
+        finally:
+            disconnected.cancel()
+            if stream:
+                stream.release(grace_seconds=CABAL_STREAM_RESUME_GRACE_SECONDS if stream_registry else 0)
+            if admitted:
+                admission.release()
     
     return StreamingResponse(
         generate_stream(),
@@ -116,3 +643,100 @@ async def chat(request: ChatRequest):
         }
     )
 
+async def run_batch_item(agent, item, timeout_seconds: float):
+    """
+    Runs the agent on a single batch prompt and returns its result: the final
+    text, the tools that were called and the run's timings.
+
+    Batch prompts are independent of each other (no sessions) and skip the
+    response cache, since the point is to exercise the agent itself.
+    """
+    if "error" in item:
+        return item
+
+    metrics = RequestMetrics()
+    texts = []
+    result = {"id": item["id"], "message": item["message"], "error": None}
+
+    # Batch prompts share the worker's admission slots with interactive /chat
+    # requests, but would rather wait their turn than be rejected. The wait
+    # counts towards the prompt's timeout, so the run only gets what's left.
+    queued_at = time.perf_counter()
+    deadline = queued_at + timeout_seconds
+    if not await admission.acquire(queue_timeout_seconds=timeout_seconds):
+        return {**result, "error": "CABAL core at capacity."}
+    metrics.queue_seconds = time.perf_counter() - queued_at
+
+    async def consume():
+        inputs = {"messages": [("user", item["message"])]}
+        async for event in agent.astream_events(input=inputs, version="v2"):
+            metrics.observe(event)
+            if event["event"] == "on_chat_model_stream":
+                text = extract_text(getattr(event["data"]["chunk"], "content", None))
+                if text:
+                    metrics.mark_first_token()
+                    texts.append(text)
+
+    try:
+        await asyncio.wait_for(consume(), timeout=max(deadline - time.perf_counter(), 0))
+    except asyncio.TimeoutError:
+        result["error"] = f"Timed out after {timeout_seconds:g}s."
+    except Exception as e:
+        print(f"CABAL Exception: {str(e)}")
+        result["error"] = f"System failure: {str(e)}"
+    finally:
+        admission.release()
+
+    metrics.finish()
+    summary = metrics.as_dict()
+    return {
+        **result,
+        "text": "".join(texts),
+        "tool_calls": summary.pop("tool_calls"),
+        "metrics": summary,
+    }
+
+# Set up FastAPI batch evaluation endpoint handler
+@app.post("/chat/batch")
+async def chat_batch(
+    http_request: Request,
+    concurrency: int = CABAL_BATCH_MAX_CONCURRENCY,
+    timeout_seconds: float = CABAL_BATCH_ITEM_TIMEOUT_SECONDS,
+):
+    """
+    Runs a JSONL body of prompts (`{"message": ..., "id": ...}` per line)
+    through the agent and streams back one JSONL result per prompt, in the
+    order they complete.
+    """
+    if timeout_seconds <= 0:
+        return JSONResponse({"error": "timeout_seconds must be greater than 0."}, status_code=400)
+
+    concurrency = max(1, min(concurrency, CABAL_BATCH_MAX_CONCURRENCY))
+    timeout_seconds = min(timeout_seconds, CABAL_BATCH_ITEM_TIMEOUT_SECONDS)
+
+    # The prompts are read up front: while the response streams, Starlette listens
+    # for a disconnect on the same channel the body would arrive on. Only the
+    # prompts in flight are parsed at any time, and results are never held onto.
+    body = await http_request.body()
+    items = (
+        parse_batch_line(number, line)
+        for number, line in enumerate(io.BytesIO(body), start=1)
+        if line.strip()
+    )
+
+    async def generate_results():
+        try:
+            agent = await aget_agent()
+        except Exception as e:
+            print(f"CABAL Exception: {str(e)}")
+            yield (json.dumps({"error": f"System failure: {str(e)}"}) + "\n").encode("utf-8")
+            return
+
+        async for result in bounded_map(
+            items,
+            lambda item: run_batch_item(agent, item, timeout_seconds),
+            concurrency,
+        ):
+            yield (json.dumps(result, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+    return StreamingResponse(generate_results(), media_type="application/x-ndjson")
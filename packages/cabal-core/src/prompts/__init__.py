@@ -1 +1,10 @@
-from .system import operational_voice_system_prompt, narrative_voice_system_prompt
\ No newline at end of file
+from .system import operational_voice_system_prompt, narrative_voice_system_prompt
+from .persona import PersonaIndex, PersonaSection, split_voice_prompt
+
+__all__ = [
+    "operational_voice_system_prompt",
+    "narrative_voice_system_prompt",
+    "PersonaIndex",
+    "PersonaSection",
+    "split_voice_prompt",
+]
@@ -0,0 +1,137 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List
+from utils import estimate_tokens, tokenize, bm25_idf, bm25_term_weight
+
+SECTION_HEADING = re.compile(r"^## ", re.MULTILINE)
+SUBSECTION_HEADING = re.compile(r"^### ", re.MULTILINE)
+
+
+@dataclass
+class PersonaSection:
+    """
+    A self-contained excerpt of a voice prompt, e.g. a quote category or a
+    single mission's briefing.
+    """
+    kind: str
+    title: str
+    text: str
+    tokens: int = 0
+    terms: Counter = field(default_factory=Counter)
+
+    def __post_init__(self):
+        self.tokens = estimate_tokens(self.text)
+        self.terms = Counter(tokenize(self.text))
+
+
+def split_voice_prompt(kind: str, prompt: str) -> "tuple[str, List[PersonaSection]]":
+    """
+    Splits a voice prompt into its preamble and its `##` sections.
+
+    Missions are split further into their `###` parts (introduction and
+    briefing), each of which keeps the mission heading so it still makes sense
+    on its own.
+    """
+    parts = SECTION_HEADING.split(prompt)
+    preamble, sections = parts[0].strip(), []
+
+    for part in parts[1:]:
+        heading, _, body = part.partition("\n")
+        heading = heading.strip()
+        subparts = SUBSECTION_HEADING.split(body)
+
+        if len(subparts) == 1:
+            sections.append(PersonaSection(kind, heading, f"## {heading}\n{body.rstrip()}"))
+            continue
+
+        if subparts[0].strip():
+            sections.append(PersonaSection(kind, heading, f"## {heading}\n{subparts[0].rstrip()}"))
+        for subpart in subparts[1:]:
+            subheading = subpart.partition("\n")[0].strip()
+            sections.append(PersonaSection(
+                kind,
+                f"{heading} ({subheading})",
+                f"## {heading}\n\n### {subpart.rstrip()}",
+            ))
+
+    return preamble, sections
+
+
+class PersonaIndex:
+    """
+    The voice prompts, split into sections that can be picked per message.
+
+    Rather than sending every quote category and mission transcript on every
+    request, slim persona mode sends the base instruction plus the few
+    sections that best match the user's message, within a token budget.
+    Sections are scored with BM25; when nothing matches (e.g. small talk) we
+    fall back to a default mix of gameplay quotes and mission excerpts.
+    """
+
+    def __init__(self, voice_prompts: Dict[str, str]):
+        self.preambles: Dict[str, str] = {}
+        self.sections: List[PersonaSection] = []
+        by_kind: Dict[str, List[int]] = {}
+
+        for kind, prompt in voice_prompts.items():
+            preamble, sections = split_voice_prompt(kind, prompt)
+            self.preambles[kind] = preamble
+            by_kind[kind] = list(range(len(self.sections), len(self.sections) + len(sections)))
+            self.sections.extend(sections)
+
+        # The fallback order takes the first section of each kind, then the second, ...
+        fallback = [i for rank in range(max(map(len, by_kind.values()), default=0))
+                    for indices in by_kind.values() if rank < len(indices) for i in [indices[rank]]]
+        self._fallback_rank = {i: rank for rank, i in enumerate(fallback)}
+
+        self._avg_length = sum(sum(s.terms.values()) for s in self.sections) / max(len(self.sections), 1)
+        document_frequency = Counter(term for s in self.sections for term in s.terms)
+        self._idf = {term: bm25_idf(df, len(self.sections)) for term, df in document_frequency.items()}
+
+    def score(self, message: str) -> List[float]:
+        query_terms = set(tokenize(message)) & self._idf.keys()
+        scores = []
+        for section in self.sections:
+            length = sum(section.terms.values())
+            scores.append(sum(
+                self._idf[term] * bm25_term_weight(section.terms[term], length, self._avg_length)
+                for term in query_terms if term in section.terms
+            ))
+        return scores
+
+    def select(self, message: str, max_sections: int, max_tokens: int) -> List[PersonaSection]:
+        """
+        Returns up to `max_sections` of the sections most relevant to
+        `message`, in prompt order, whose combined size (preambles included)
+        fits in `max_tokens`.
+        """
+        scores = self.score(message)
+        ranked = sorted(range(len(self.sections)), key=lambda i: (-scores[i], self._fallback_rank[i]))
+
+        chosen, kinds, remaining = [], set(), max_tokens
+        for i in ranked:
+            section = self.sections[i]
+            cost = section.tokens
+            if section.kind not in kinds:
+                cost += estimate_tokens(self.preambles[section.kind])
+            if cost > remaining:
+                continue
+            chosen.append(i)
+            kinds.add(section.kind)
+            remaining -= cost
+            if len(chosen) == max_sections:
+                break
+
+        return [self.sections[i] for i in sorted(chosen)]
+
+    def render(self, sections: List[PersonaSection]) -> str:
+        """
+        Formats selected sections as prompt text, grouped under their preambles.
+        """
+        blocks = []
+        for kind, preamble in self.preambles.items():
+            texts = [section.text for section in sections if section.kind == kind]
+            if texts:
+                blocks.append("\n\n".join([preamble, *texts]))
+        return "\n\n".join(blocks)
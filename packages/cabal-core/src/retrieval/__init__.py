@@ -0,0 +1,18 @@
+from .cache import RetrievalCache
+from .compress import compress_passages, source_url
+from .prefetch import (
+    ArchivePrefetch,
+    active_prefetch,
+    take_prefetched,
+    looks_like_archive_question,
+)
+
+__all__ = [
+    "RetrievalCache",
+    "compress_passages",
+    "source_url",
+    "ArchivePrefetch",
+    "active_prefetch",
+    "take_prefetched",
+    "looks_like_archive_question",
+]
@@ -0,0 +1,386 @@
+"""
+Builds a `LocalArchiveIndex` from the cabal-harvester output, incrementally.
+
+Usage (from packages/cabal-core/src):
+
+    python -m retrieval.build_index --source ../../cabal-harvester/dist/harvested
+
+Every run records a content hash per harvested page and per chunk
+(`corpus_state.json` in the index directory). Re-runs only parse and chunk the
+pages whose bytes changed, and only embed chunks whose hash the previous build
+hasn't seen; everything else is carried over from the existing index. Pass
+`--rebuild` to start from scratch.
+
+With `--upload s3://bucket/prefix`, only pages that differ from what was last
+uploaded there are uploaded to the knowledge base's data source (and deleted
+pages removed from it), so the KB sync that follows only re-ingests those. `--knowledge-base-id` and
+`--data-source-id` start that sync straight away.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from .embeddings import get_embeddings
+from .local_index import (
+    DEFAULT_INDEX_DIR,
+    INDEX_CHUNKS_FILE,
+    INDEX_EMBEDDINGS_FILE,
+    INDEX_KEYWORDS_FILE,
+    INDEX_MANIFEST_FILE,
+    build_keyword_index,
+)
+
+# Roughly 300 tokens per chunk with 20% overlap, mirroring the KB's chunking strategy
+CHUNK_MAX_WORDS = 225
+CHUNK_OVERLAP_WORDS = 45
+
+# Per-page and per-chunk content hashes from the last build
+CORPUS_STATE_FILE = "corpus_state.json"
+
+# Bump whenever parsing, normalization or chunking changes, so the next run
+# re-chunks every page instead of trusting the recorded hashes
+CORPUS_STATE_VERSION = 1
+
+# Page hashes last uploaded to each S3 data source, and how many uploads we
+# make between saves of that record
+UPLOAD_STATE_FILE = "upload_state.json"
+UPLOAD_STATE_SAVE_EVERY = 100
+
+# Chunks sent per embed_documents call
+EMBED_BATCH_SIZE = 64
+
+# Zero-width characters that wiki markup leaves behind, invisible but not
+# ignored by tokenizers or hashes
+ZERO_WIDTH_CHARACTERS = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad]")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Folds compatibility characters (e.g. non-breaking spaces, ligatures) and
+    strips zero-width ones, so cosmetic wiki edits don't change chunk hashes.
+    """
+    return ZERO_WIDTH_CHARACTERS.sub("", unicodedata.normalize("NFKC", text))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_harvested_file(path: str) -> Tuple[str, str, str]:
+    """
+    Splits a harvested page into its subject, URL and body.
+
+    See `scrapePage` in cabal-harvester for the file layout.
+    """
+    with open(path, encoding="utf-8") as f:
+        header, _, body = normalize_text(f.read()).partition("----------------------------------------")
+
+    title, url = "", ""
+    for line in header.splitlines():
+        if line.startswith("SUBJECT:"):
+            title = line.removeprefix("SUBJECT:").strip()
+        elif line.startswith("URL:"):
+            url = line.removeprefix("URL:").strip()
+
+    return title, url, body.strip()
+
+
+def chunk_text(
+    text: str,
+    max_words: int = CHUNK_MAX_WORDS,
+    overlap_words: int = CHUNK_OVERLAP_WORDS,
+) -> Iterator[str]:
+    """
+    Yields overlapping windows of at most `max_words` words.
+    """
+    words = text.split()
+    step = max_words - overlap_words
+    for start in range(0, max(len(words) - overlap_words, 1), step):
+        window = words[start:start + max_words]
+        if window:
+            yield " ".join(window)
+
+
+def chunk_page(path: str) -> List[Dict[str, str]]:
+    """
+    Parses and chunks one harvested page. Runs in a worker process.
+    """
+    title, url, body = parse_harvested_file(path)
+    chunks = []
+    for text in chunk_text(body):
+        # Prefix each chunk with its subject so it stands on its own when retrieved
+        text = f"SUBJECT: {title}\n\n{text}"
+        chunks.append({"hash": content_hash(text.encode("utf-8")), "title": title, "url": url, "text": text})
+    return chunks
+
+
+def load_previous_build(
+    output_dir: str, embeddings_name: str, dimensions: int
+) -> Tuple[Dict[str, Any], Dict[str, Tuple[Dict[str, str], np.ndarray]]]:
+    """
+    Returns the recorded page hashes of the last build in `output_dir`, and
+    its chunks (with their vectors) by hash.
+
+    Nothing is reused if that build is incomplete, predates content hashes,
+    or was embedded with a different model.
+    """
+    try:
+        with open(os.path.join(output_dir, INDEX_MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(os.path.join(output_dir, CORPUS_STATE_FILE), encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}, {}
+
+    if (
+        state.get("version") != CORPUS_STATE_VERSION
+        or manifest["embeddings"] != embeddings_name
+        or manifest["dimensions"] != dimensions
+    ):
+        return {}, {}
+
+    vectors = np.load(os.path.join(output_dir, INDEX_EMBEDDINGS_FILE), mmap_mode="r")
+    chunks = {}
+    with open(os.path.join(output_dir, INDEX_CHUNKS_FILE), encoding="utf-8") as f:
+        for row, line in enumerate(f):
+            chunk = json.loads(line)
+            if "hash" in chunk:
+                # Copied out of the memory map, since we're about to overwrite the file
+                chunks[chunk["hash"]] = (chunk, np.array(vectors[row]))
+
+    return state["pages"], chunks
+
+
+def embed_chunks(texts: List[str], embeddings_name: str, dimensions: int, workers: int) -> np.ndarray:
+    """
+    Embeds texts in batches, with up to `workers` batches in flight.
+    """
+    if not texts:
+        return np.zeros((0, dimensions), dtype=np.float32)
+
+    embeddings = get_embeddings(embeddings_name, dimensions)
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(embeddings.embed_documents, batches))
+    return np.asarray([vector for batch in results for vector in batch], dtype=np.float32).reshape(len(texts), dimensions)
+
+
+def build_index(
+    source_dir: str,
+    output_dir: str,
+    embeddings_name: str,
+    dimensions: int,
+    workers: Optional[int] = None,
+    rebuild: bool = False,
+) -> Dict[str, Any]:
+    """
+    Chunks, embeds and writes every harvested page under `source_dir` into an
+    index directory, reusing whatever the previous build there already did.
+
+    Returns a report of what changed: the pages added, changed and deleted
+    since the last build, and how many chunks were embedded vs reused.
+    """
+    started = time.monotonic()
+    workers = workers or os.cpu_count() or 1
+    previous_pages, previous_chunks = ({}, {}) if rebuild else load_previous_build(output_dir, embeddings_name, dimensions)
+
+    # We stream over the harvested pages, hashing each one to find the few that
+    # changed; only those are parsed and chunked (in parallel)
+    pages: Dict[str, Dict[str, Any]] = {}
+    stale: List[str] = []
+    for path in sorted(glob.glob(os.path.join(source_dir, "*.txt"))):
+        name = os.path.basename(path)
+        with open(path, "rb") as f:
+            page_hash = content_hash(f.read())
+
+        previous = previous_pages.get(name)
+        if previous and previous["hash"] == page_hash and all(h in previous_chunks for h in previous["chunks"]):
+            pages[name] = previous
+        else:
+            pages[name] = {"hash": page_hash, "chunks": []}
+            stale.append(path)
+
+    new_chunks: Dict[str, Dict[str, str]] = {}
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, chunks in zip(stale, executor.map(chunk_page, stale, chunksize=16)):
+                pages[os.path.basename(path)]["chunks"] = [chunk["hash"] for chunk in chunks]
+                for chunk in chunks:
+                    if chunk["hash"] not in previous_chunks:
+                        new_chunks.setdefault(chunk["hash"], chunk)
+
+    new_vectors = embed_chunks([chunk["text"] for chunk in new_chunks.values()], embeddings_name, dimensions, workers)
+    new_rows = {chunk_hash: row for row, chunk_hash in enumerate(new_chunks)}
+
+    chunks: List[Dict[str, str]] = []
+    vectors = np.zeros((sum(len(page["chunks"]) for page in pages.values()), dimensions), dtype=np.float32)
+    for page in pages.values():
+        for chunk_hash in page["chunks"]:
+            if chunk_hash in new_rows:
+                chunk, vector = new_chunks[chunk_hash], new_vectors[new_rows[chunk_hash]]
+            else:
+                chunk, vector = previous_chunks[chunk_hash]
+            vectors[len(chunks)] = vector
+            chunks.append(chunk)
+
+    write_index(output_dir, embeddings_name, dimensions, chunks, vectors, pages)
+
+    unchanged = {name for name, page in pages.items() if previous_pages.get(name, {}).get("hash") == page["hash"]}
+    return {
+        "pages": len(pages),
+        "added": sorted(name for name in pages if name not in previous_pages),
+        "changed": sorted(name for name in pages if name in previous_pages and name not in unchanged),
+        "deleted": sorted(name for name in previous_pages if name not in pages),
+        "chunks": len(chunks),
+        "embedded": len(new_chunks),
+        "reused": len(chunks) - sum(1 for chunk in chunks if chunk["hash"] in new_rows),
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+
+def write_index(
+    output_dir: str,
+    embeddings_name: str,
+    dimensions: int,
+    chunks: List[Dict[str, str]],
+    vectors: np.ndarray,
+    pages: Dict[str, Dict[str, Any]],
+) -> None:
+    # The manifest is written last, so we drop any old one first to make sure
+    # a half-built index fails to load
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, INDEX_MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    np.save(os.path.join(output_dir, INDEX_EMBEDDINGS_FILE), vectors)
+
+    # Saved uncompressed, since loading it fast matters more than its size
+    np.savez(
+        os.path.join(output_dir, INDEX_KEYWORDS_FILE),
+        **build_keyword_index(chunk["text"] for chunk in chunks),
+    )
+
+    fingerprint = hashlib.sha256(f"{embeddings_name}:{dimensions}".encode("utf-8"))
+    with open(os.path.join(output_dir, INDEX_CHUNKS_FILE), "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            line = json.dumps(chunk, ensure_ascii=False) + "\n"
+            fingerprint.update(line.encode("utf-8"))
+            f.write(line)
+
+    with open(os.path.join(output_dir, CORPUS_STATE_FILE), "w", encoding="utf-8") as f:
+        json.dump({"version": CORPUS_STATE_VERSION, "pages": pages}, f)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "embeddings": embeddings_name,
+            "dimensions": dimensions,
+            "count": len(chunks),
+            "keywords": INDEX_KEYWORDS_FILE,
+            "fingerprint": fingerprint.hexdigest(),
+        }, f, indent=2)
+
+
+def upload_changes(
+    output_dir: str,
+    source_dir: str,
+    s3_uri: str,
+    knowledge_base_id: Optional[str] = None,
+    data_source_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Mirrors the pages of the last build in `output_dir` to the knowledge
+    base's S3 data source, and optionally starts a KB sync. Returns how many
+    pages were uploaded and deleted, and the ingestion job ID if one was
+    started.
+
+    We diff against what was last uploaded to `s3_uri` (`upload_state.json`),
+    not against the previous build, so pages from builds that were never
+    uploaded (or whose upload failed partway) are still picked up. Each page
+    is only recorded once its upload or delete succeeded.
+
+    The KB only re-ingests objects that changed since its last sync, so
+    leaving unchanged pages alone keeps the sync down to seconds.
+    """
+    # Imported lazily since boto3 is only needed for uploads
+    import boto3
+
+    with open(os.path.join(output_dir, CORPUS_STATE_FILE), encoding="utf-8") as f:
+        pages = {name: page["hash"] for name, page in json.load(f)["pages"].items()}
+
+    state_path = os.path.join(output_dir, UPLOAD_STATE_FILE)
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            upload_state = json.load(f)
+    except FileNotFoundError:
+        upload_state = {}
+    uploaded = upload_state.setdefault(s3_uri, {})
+
+    bucket, _, prefix = s3_uri.removeprefix("s3://").partition("/")
+    prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    to_upload = sorted(name for name, page_hash in pages.items() if uploaded.get(name) != page_hash)
+    to_delete = sorted(name for name in uploaded if name not in pages)
+
+    s3 = boto3.client("s3")
+    try:
+        for n, name in enumerate(to_upload):
+            s3.upload_file(os.path.join(source_dir, name), bucket, prefix + name)
+            uploaded[name] = pages[name]
+            if n % UPLOAD_STATE_SAVE_EVERY == UPLOAD_STATE_SAVE_EVERY - 1:
+                _save_upload_state(state_path, upload_state)
+        for name in to_delete:
+            s3.delete_object(Bucket=bucket, Key=prefix + name)
+            del uploaded[name]
+    finally:
+        _save_upload_state(state_path, upload_state)
+
+    result = {"uploaded": len(to_upload), "deleted": len(to_delete), "ingestion_job_id": None}
+    if knowledge_base_id and data_source_id:
+        response = boto3.client("bedrock-agent").start_ingestion_job(
+            knowledgeBaseId=knowledge_base_id,
+            dataSourceId=data_source_id,
+        )
+        result["ingestion_job_id"] = response["ingestionJob"]["ingestionJobId"]
+    return result
+
+
+def _save_upload_state(path: str, upload_state: Dict[str, Dict[str, str]]) -> None:
+    # Written to a temporary file first, so an interrupted save can't lose the record
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(upload_state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update a local Nod archives index.")
+    parser.add_argument("--source", required=True, help="Directory of harvested *.txt pages")
+    parser.add_argument("--output", default=DEFAULT_INDEX_DIR, help="Index output directory")
+    parser.add_argument("--embeddings", default="hashing", choices=["hashing", "titan"])
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--workers", type=int, help="Parallel chunking processes and embedding batches (default: CPU count)")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the previous build and process every page")
+    parser.add_argument("--upload", help="s3://bucket/prefix of the KB data source to mirror changed pages to")
+    parser.add_argument("--knowledge-base-id", help="With --upload, start a KB sync afterwards")
+    parser.add_argument("--data-source-id", help="With --upload, start a KB sync afterwards")
+    args = parser.parse_args()
+
+    report = build_index(args.source, args.output, args.embeddings, args.dimensions, args.workers, args.rebuild)
+    print(
+        f"[CABAL Archives] Indexed {report['chunks']} chunks from {report['pages']} pages into {args.output} "
+        f"in {report['seconds']}s: {len(report['added'])} added, {len(report['changed'])} changed, "
+        f"{len(report['deleted'])} deleted; {report['embedded']} chunks embedded, {report['reused']} reused"
+    )
+
+    if args.upload:
+        result = upload_changes(args.output, args.source, args.upload, args.knowledge_base_id, args.data_source_id)
+        print(f"[CABAL Archives] Uploaded {result['uploaded']} pages to {args.upload}, deleted {result['deleted']}")
+        if result["ingestion_job_id"]:
+            print(f"[CABAL Archives] Started KB sync {result['ingestion_job_id']}")
@@ -0,0 +1,78 @@
+import json
+from typing import List, Optional
+from langchain_core.documents import Document
+from utils import TieredCache, normalize_query
+
+
+class RetrievalCache:
+    """
+    A two-tiered cache for knowledge base lookups, keyed on the normalized
+    query (see `TieredCache` for the tiers).
+
+    Entries are scoped to a namespace (e.g. the KB ID plus its latest
+    ingestion job), so moving to a new namespace after a KB re-sync (see
+    `invalidate`) orphans every stale entry.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 256,
+        ttl_seconds: float = 3600,
+        db_path: Optional[str] = None,
+    ):
+        self._cache: TieredCache[List[Document]] = TieredCache(
+            table="archive_cache",
+            max_entries=max_entries,
+            ttl_seconds=ttl_seconds,
+            db_path=db_path,
+            namespace=namespace,
+            dumps=_dump_documents,
+            loads=_load_documents,
+        )
+
+    @property
+    def namespace(self) -> str:
+        return self._cache.namespace
+
+    def get(self, query: str) -> Optional[List[Document]]:
+        """
+        Returns the cached documents for a query, or None on a miss. May block
+        on SQLite, so it's best called off the event loop.
+        """
+        return self._cache.get(normalize_query(query))
+
+    def get_memory(self, query: str) -> Optional[List[Document]]:
+        """
+        Returns the documents for a query from the in-memory tier only, or
+        None if they aren't there. Never blocks on I/O.
+        """
+        return self._cache.get_memory(normalize_query(query))
+
+    def set(self, query: str, documents: List[Document]) -> None:
+        """
+        Stores the documents returned for a query in every enabled tier.
+        """
+        self._cache.set(normalize_query(query), documents)
+
+    def invalidate(self, namespace: str) -> None:
+        """
+        Moves the cache to a new namespace, dropping every entry in both
+        tiers, e.g. once the knowledge base has been re-synced.
+        """
+        self._cache.invalidate(namespace)
+
+
+def _dump_documents(documents: List[Document]) -> str:
+    return json.dumps(
+        [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents],
+        ensure_ascii=False,
+        default=str,
+    )
+
+
+def _load_documents(value: str) -> List[Document]:
+    return [
+        Document(page_content=doc["page_content"], metadata=doc["metadata"])
+        for doc in json.loads(value)
+    ]
@@ -0,0 +1,161 @@
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from utils import estimate_tokens, CHARS_PER_TOKEN, tokenize, bm25_idf
+
+# Words per shingle when comparing paragraphs for near-duplicates
+SHINGLE_SIZE = 4
+
+# Share of the rerank score that comes from the retriever's own ranking, so
+# passages that merely repeat query terms can't leapfrog a strong semantic match
+RANK_PRIOR_WEIGHT = 0.3
+
+# Don't bother cutting a passage down to fewer tokens than this
+MIN_TRIMMED_TOKENS = 40
+
+PARAGRAPH_SPLIT = re.compile(r"\n+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[Tuple[str, ...]]:
+    """
+    Returns the set of `size`-word shingles in `text`.
+
+    Text shorter than a single shingle is returned as one (shorter) shingle, so
+    repeated short lines like headings and navigation still match exactly.
+    """
+    words = tokenize(text)
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a: Set[Tuple[str, ...]], b: Set[Tuple[str, ...]]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def source_url(document: Document) -> Optional[str]:
+    """
+    Finds the source URL of a retrieved passage.
+
+    Local index passages carry it as `source`, while Bedrock KB passages carry
+    it in their `location` (web or S3, depending on the data source).
+    """
+    metadata: Dict[str, Any] = document.metadata or {}
+    if metadata.get("source"):
+        return metadata["source"]
+
+    location = metadata.get("location") or {}
+    for key, field in (("webLocation", "url"), ("s3Location", "uri")):
+        if location.get(key, {}).get(field):
+            return location[key][field]
+
+    return (metadata.get("source_metadata") or {}).get("x-amz-bedrock-kb-source-uri")
+
+
+def dedupe_passages(documents: List[Document], threshold: float) -> List[Document]:
+    """
+    Drops paragraphs that (nearly) repeat a paragraph from an earlier passage.
+
+    Wiki pages share a lot of boilerplate (infobox labels, navigation, "see
+    also" lists), and overlapping chunks repeat whole paragraphs. Comparing
+    paragraphs rather than whole passages lets us keep the new material in a
+    passage while cutting what the model has already read. Passages left with
+    nothing new are dropped altogether.
+    """
+    kept_shingles: List[Set[Tuple[str, ...]]] = []
+    deduped = []
+
+    for document in documents:
+        paragraphs = []
+        for paragraph in PARAGRAPH_SPLIT.split(document.page_content):
+            paragraph = paragraph.strip()
+            paragraph_shingles = shingles(paragraph)
+            if not paragraph_shingles:
+                continue
+            if any(_jaccard(paragraph_shingles, seen) >= threshold for seen in kept_shingles):
+                continue
+            kept_shingles.append(paragraph_shingles)
+            paragraphs.append(paragraph)
+
+        if paragraphs:
+            deduped.append(Document(page_content="\n".join(paragraphs), metadata=document.metadata))
+
+    return deduped
+
+
+def rerank_passages(query: str, documents: List[Document]) -> List[Document]:
+    """
+    Reorders passages by how well they cover the query's terms.
+
+    Each query term is weighted by its IDF across the retrieved passages, so
+    a passage that mentions the rare, specific term ("Montauk") beats one
+    that only mentions the common one ("Nod"). The retriever's ranking is
+    blended in as a prior.
+    """
+    query_terms = set(tokenize(query))
+    if not query_terms or len(documents) < 2:
+        return documents
+
+    passage_terms = [set(tokenize(document.page_content)) for document in documents]
+    document_frequency = Counter(term for terms in passage_terms for term in terms & query_terms)
+    idf = {term: bm25_idf(document_frequency[term], len(documents)) for term in query_terms}
+    total_idf = sum(idf.values())
+
+    def score(i: int) -> float:
+        coverage = sum(idf[term] for term in query_terms & passage_terms[i]) / total_idf
+        rank_prior = 1 - i / len(documents)
+        return (1 - RANK_PRIOR_WEIGHT) * coverage + RANK_PRIOR_WEIGHT * rank_prior
+
+    order = sorted(range(len(documents)), key=lambda i: -score(i))
+    return [documents[i] for i in order]
+
+
+def _trim(text: str, max_tokens: int) -> str:
+    """
+    Cuts `text` down to `max_tokens`, at a sentence boundary where possible.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    trimmed = ""
+    for sentence in SENTENCE_END.split(text):
+        candidate = f"{trimmed} {sentence}" if trimmed else sentence
+        if len(candidate) > max_chars:
+            break
+        trimmed = candidate
+    # A single overly long sentence still gets cut, just not at a boundary
+    return trimmed or text[:max_chars].rsplit(" ", 1)[0]
+
+
+def compress_passages(
+    query: str,
+    documents: List[Document],
+    max_tokens: int,
+    dedupe_threshold: float,
+) -> List[Document]:
+    """
+    Dedupes, reranks and trims retrieved passages to fit a token budget.
+
+    Passages are added in reranked order until the budget runs out; the last
+    one that fits only partially is trimmed. A `max_tokens` of 0 disables the
+    budget. Passage metadata (and so the source URL) is kept as is.
+    """
+    documents = rerank_passages(query, dedupe_passages(documents, dedupe_threshold))
+    if max_tokens <= 0:
+        return documents
+
+    compressed = []
+    remaining = max_tokens
+    for document in documents:
+        tokens = estimate_tokens(document.page_content)
+        if tokens <= remaining:
+            compressed.append(document)
+            remaining -= tokens
+            continue
+        if remaining >= MIN_TRIMMED_TOKENS:
+            compressed.append(Document(page_content=_trim(document.page_content, remaining), metadata=document.metadata))
+        break
+
+    return compressed
@@ -0,0 +1,69 @@
+import math
+import zlib
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from utils import tokenize
+
+# Same embedding model that backs the Bedrock knowledge base
+TITAN_EMBEDDINGS_MODEL_ID = "amazon.titan-embed-text-v2:0"
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Dependency-free embeddings based on the hashing trick.
+
+    Each unigram and bigram is hashed into one of `dimensions` buckets with a
+    signed, sublinear term frequency. This is far cruder than a learned model,
+    but it's deterministic, needs no network access and does well enough on a
+    small, proper noun heavy corpus like the Nod archives.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+    def _embed(self, text: str) -> np.ndarray:
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+        counts = {}
+        for feature in features:
+            counts[feature] = counts.get(feature, 0) + 1
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, count in counts.items():
+            # We use crc32 rather than `hash()`, which is salted per process
+            digest = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dimensions] += sign * (1.0 + math.log(count))
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def get_embeddings(name: str, dimensions: int) -> Embeddings:
+    """
+    Returns the embeddings model registered under `name`.
+
+    The local index records which model built it, so queries are always
+    embedded with the same model as the documents.
+    """
+    if name == "hashing":
+        return HashingEmbeddings(dimensions=dimensions)
+
+    if name == "titan":
+        # Imported lazily since the Bedrock client is only needed for this model
+        from langchain_aws import BedrockEmbeddings
+        return BedrockEmbeddings(
+            model_id=TITAN_EMBEDDINGS_MODEL_ID,
+            dimensions=dimensions,
+            normalize=True,
+        )
+
+    raise ValueError(f"Unknown embeddings model: {name}")
@@ -0,0 +1,173 @@
+import json
+import os
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from utils import tokenize, bm25_idf, bm25_term_weight
+from .embeddings import get_embeddings
+
+# Default location of the prebuilt index, which ships inside the image with src/
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "nod_archives_index")
+
+# Files that make up an index directory
+INDEX_MANIFEST_FILE = "manifest.json"
+INDEX_EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_CHUNKS_FILE = "chunks.jsonl"
+INDEX_KEYWORDS_FILE = "keywords.npz"
+
+
+def build_keyword_index(texts: Iterable[str]) -> Dict[str, np.ndarray]:
+    """
+    Builds the BM25 inverted index over chunk texts as flat arrays.
+
+    The postings of `terms[i]` are `doc_ids[offsets[i]:offsets[i + 1]]` (and
+    the matching `term_frequencies`). Flat arrays save to and load from an
+    .npz file in one go, without re-tokenizing the corpus on every cold start.
+    """
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    lengths = []
+    for i, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        lengths.append(sum(counts.values()))
+        for term, count in counts.items():
+            postings.setdefault(term, []).append((i, count))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    doc_ids, term_frequencies = [], []
+    for n, term in enumerate(terms):
+        for i, count in postings[term]:
+            doc_ids.append(i)
+            term_frequencies.append(count)
+        offsets[n + 1] = len(doc_ids)
+
+    return {
+        "terms": np.asarray(terms, dtype=np.str_),
+        "offsets": offsets,
+        "doc_ids": np.asarray(doc_ids, dtype=np.int32),
+        "term_frequencies": np.asarray(term_frequencies, dtype=np.float32),
+        "doc_lengths": np.asarray(lengths, dtype=np.float32),
+    }
+
+
+class LocalArchiveIndex:
+    """
+    An in-process vector index over the harvested Nod archives.
+
+    The embedding matrix is memory-mapped, so loading an index only pays for
+    the pages that top-k queries actually touch. A small inverted index
+    supports BM25 keyword scoring alongside vector similarity; it's loaded
+    from the index directory when the build saved one, and built on load
+    otherwise.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, INDEX_MANIFEST_FILE), encoding="utf-8") as f:
+            self.manifest: Dict[str, Any] = json.load(f)
+
+        with open(os.path.join(directory, INDEX_CHUNKS_FILE), encoding="utf-8") as f:
+            self.chunks: List[Dict[str, Any]] = [json.loads(line) for line in f if line.strip()]
+
+        # Rows are L2-normalized at build time, so a dot product is a cosine similarity
+        self.vectors = np.load(os.path.join(directory, INDEX_EMBEDDINGS_FILE), mmap_mode="r")
+        self.embeddings = get_embeddings(self.manifest["embeddings"], self.manifest["dimensions"])
+
+        keywords_file = self.manifest.get("keywords")
+        if keywords_file:
+            with np.load(os.path.join(directory, keywords_file)) as keywords:
+                self._set_keyword_index(dict(keywords))
+        else:
+            self._set_keyword_index(build_keyword_index(chunk["text"] for chunk in self.chunks))
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        A content hash identifying this build of the index.
+        """
+        return self.manifest["fingerprint"]
+
+    def search(self, query: str, k: int = 5, keyword_weight: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        Returns the (chunk index, score) pairs of the top-k chunks for a query.
+
+        Args:
+            query: The query to search for.
+            k: The number of chunks to return.
+            keyword_weight: How much of the final score comes from BM25, from 0
+                (pure vector similarity) to 1 (pure keyword search).
+        """
+        if not self.chunks:
+            return []
+
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        scores = self.vectors @ query_vector
+
+        if keyword_weight:
+            keyword_scores = self._bm25_scores(query)
+            top_keyword_score = keyword_scores.max()
+            if top_keyword_score > 0:
+                scores = (
+                    (1 - keyword_weight) * scores
+                    + keyword_weight * (keyword_scores / top_keyword_score)
+                )
+
+        # argpartition avoids sorting the whole corpus just to get the top-k
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def _set_keyword_index(self, keywords: Dict[str, np.ndarray]) -> None:
+        self._terms = {term: i for i, term in enumerate(keywords["terms"].tolist())}
+        self._offsets = keywords["offsets"]
+        self._doc_ids = keywords["doc_ids"]
+        self._term_frequencies = keywords["term_frequencies"]
+        self._doc_lengths = keywords["doc_lengths"]
+        self._avg_doc_length = float(self._doc_lengths.mean()) if len(self._doc_lengths) else 0.0
+
+    def _bm25_scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        total = len(self.chunks)
+        for term in set(tokenize(query)):
+            if term not in self._terms:
+                continue
+            start, end = self._offsets[self._terms[term]:self._terms[term] + 2]
+            ids, term_frequencies = self._doc_ids[start:end], self._term_frequencies[start:end]
+            scores[ids] += bm25_idf(len(ids), total) * bm25_term_weight(
+                term_frequencies, self._doc_lengths[ids], self._avg_doc_length
+            )
+        return scores
+
+
+class LocalArchiveRetriever(BaseRetriever):
+    """
+    A drop-in replacement for `AmazonKnowledgeBasesRetriever` which searches a
+    `LocalArchiveIndex` instead of calling Bedrock's Retrieve API.
+    """
+
+    index: LocalArchiveIndex
+    k: int = 5
+    keyword_weight: float = 0.0
+
+    @classmethod
+    def from_directory(cls, directory: str, **kwargs: Any) -> "LocalArchiveRetriever":
+        return cls(index=LocalArchiveIndex(directory), **kwargs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        documents = []
+        for i, score in self.index.search(query, k=self.k, keyword_weight=self.keyword_weight):
+            chunk = self.index.chunks[i]
+            documents.append(Document(
+                page_content=chunk["text"],
+                metadata={
+                    "title": chunk["title"],
+                    "source": chunk["url"],
+                    "score": score,
+                },
+            ))
+        return documents
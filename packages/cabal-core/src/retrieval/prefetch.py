@@ -0,0 +1,109 @@
+import asyncio
+import re
+from contextvars import ContextVar
+from typing import List, Optional
+from langchain_core.documents import Document
+from utils import normalize_query, tokenize
+
+# Terms that, when mentioned, almost always lead the agent to consult the archives
+LORE_TERMS = frozenset("""
+nod gdi cabal kane slavik mcneil oxanna vega hassan umagon tratos tacitus
+forgotten mutant mutants scrin tiberium tiberian firestorm visceroid visceroids
+cyborg cyborgs commando harvester harvesters mammoth obelisk banshee orca orcas
+titan wolverine juggernaut disruptor hover mlrs kodiak philadelphia montauk
+refinery silo silos barracks temple artillery weed eater buggy
+subterranean apc stealth tick chameleon spy engineer ghost stalker jumpjet
+ion cannon emp missile missiles mission missions campaign faction factions
+unit units building buildings structure structures weapon weapons armor
+""".split())
+
+# Multi-word names we match on the raw (lowercased) message
+LORE_PHRASES = (
+    "hand of nod", "war factory", "power plant", "tick tank", "stealth tank",
+    "devil's tongue", "cyborg commando", "mammoth mk", "ion cannon", "firestorm defense",
+    "brotherhood", "global defense initiative", "black hand", "tiberian sun",
+)
+
+QUESTION_CUES = re.compile(
+    r"\b(who|what|when|where|which|why|how|tell me|describe|explain|history|stats?)\b"
+)
+
+# Share of a tool query's terms that must appear in the prefetched query for a match
+PREFETCH_MATCH_THRESHOLD = 0.6
+
+
+def looks_like_archive_question(message: str) -> bool:
+    """
+    A cheap, local guess at whether the agent will consult the Nod archives.
+
+    We look for a question cue along with at least one Tiberian Sun term. A
+    false positive only costs a (cacheable) KB lookup, while a false negative
+    just means we fall back to the usual serial tool call.
+    """
+    lowered = message.lower()
+    if not QUESTION_CUES.search(lowered):
+        return False
+    if any(phrase in lowered for phrase in LORE_PHRASES):
+        return True
+    return any(token in LORE_TERMS for token in tokenize(lowered))
+
+
+class ArchivePrefetch:
+    """
+    A KB lookup started speculatively, alongside the agent's first model turn.
+
+    If the agent then calls the archives tool with a query that matches the
+    prefetched one, the tool awaits the prefetched lookup instead of starting
+    its own. Only the first matching tool query gets to use it.
+
+    Each prefetch ends up as a hit (used by the tool), a miss (the tool was
+    called, but never with a matching query) or unused (no tool call at all).
+    """
+
+    def __init__(self, query: str, task: "asyncio.Future[List[Document]]"):
+        self.query = query
+        self.task = task
+        self.outcome: Optional[str] = None
+        self._offered = False
+        self._terms = set(tokenize(query))
+
+    def matches(self, query: str) -> bool:
+        if normalize_query(query) == normalize_query(self.query):
+            return True
+        terms = set(tokenize(query))
+        if not terms:
+            return False
+        return len(terms & self._terms) / len(terms) >= PREFETCH_MATCH_THRESHOLD
+
+    def take(self, query: str) -> "Optional[asyncio.Future[List[Document]]]":
+        """
+        Returns the prefetched lookup if it can serve `query`, or None.
+        """
+        if self.outcome is not None:
+            return None
+        self._offered = True
+        if not self.matches(query):
+            return None
+        self.outcome = "hits"
+        return self.task
+
+    def close(self) -> None:
+        """
+        Cancels the lookup if the agent never used it.
+        """
+        if self.outcome is None:
+            self.outcome = "misses" if self._offered else "unused"
+            self.task.cancel()
+
+
+# The prefetch for the agent run in the current context. Tool calls run in tasks
+# spawned by the agent, which inherit this from the request that started the run.
+active_prefetch: ContextVar[Optional[ArchivePrefetch]] = ContextVar("active_prefetch", default=None)
+
+
+def take_prefetched(query: str) -> "Optional[asyncio.Future[List[Document]]]":
+    """
+    Returns the current run's prefetched lookup for `query`, if there is one.
+    """
+    prefetch = active_prefetch.get()
+    return prefetch.take(query) if prefetch else None
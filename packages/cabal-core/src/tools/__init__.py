@@ -1,3 +1,3 @@
-from .query_nod_archives import query_nod_archives
+from .query_nod_archives import query_nod_archives, prefetch_nod_archives
 
-__all__ = ["query_nod_archives"]
+__all__ = ["query_nod_archives", "prefetch_nod_archives"]
@@ -1,38 +1,391 @@
+import asyncio
 import os
-import boto3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional
 from langchain_aws import AmazonKnowledgeBasesRetriever
-from langchain_core.tools import tool
+from langchain_core.documents import Document
+from langchain_core.tools import StructuredTool
+from retrieval import (
+    RetrievalCache,
+    ArchivePrefetch,
+    take_prefetched,
+    compress_passages,
+    source_url,
+)
+from utils import (
+    get_client,
+    get_latency_histogram,
+    call_hedged,
+    TOOL_ERROR_PREFIX,
+    TOOL_WARNING_PREFIX,
+)
+
+# Max number of Retrieve calls we allow in flight per worker
+NOD_ARCHIVES_MAX_WORKERS = int(os.environ.get("NOD_ARCHIVES_MAX_WORKERS", "8"))
+
+# Max number of seconds we wait on a single Retrieve call
+NOD_ARCHIVES_TIMEOUT_SECONDS = float(os.environ.get("NOD_ARCHIVES_TIMEOUT_SECONDS", "10"))
+
+# Max number of reformulated sub-queries we fan out alongside the main query
+NOD_ARCHIVES_MAX_SUB_QUERIES = int(os.environ.get("NOD_ARCHIVES_MAX_SUB_QUERIES", "3"))
+
+# Which retriever backs the tool: "bedrock" (the Nod Archives KB) or "local"
+# (an in-process index built with `python -m retrieval.build_index`). The local
+# index lives in src/nod_archives_index unless told otherwise.
+NOD_ARCHIVES_BACKEND = os.environ.get("NOD_ARCHIVES_BACKEND", "bedrock")
+NOD_ARCHIVES_LOCAL_INDEX_DIR = os.environ.get("NOD_ARCHIVES_LOCAL_INDEX_DIR")
+
+# Share of the local backend's score that comes from BM25 keyword matching
+NOD_ARCHIVES_LOCAL_KEYWORD_WEIGHT = float(os.environ.get("NOD_ARCHIVES_LOCAL_KEYWORD_WEIGHT", "0.3"))
+
+# Retrieval cache settings. The persistent tier is opt-in: point it at a file
+# on /tmp to keep hot lookups across warm Lambda invocations. With the bedrock
+# backend, we check for a newly completed KB sync (ingestion job) every
+# refresh interval and drop every cached lookup when there is one; with an
+# interval of 0, cached lookups only go away when their TTL runs out.
+NOD_ARCHIVES_CACHE_MAX_ENTRIES = int(os.environ.get("NOD_ARCHIVES_CACHE_MAX_ENTRIES", "256"))
+NOD_ARCHIVES_CACHE_TTL_SECONDS = float(os.environ.get("NOD_ARCHIVES_CACHE_TTL_SECONDS", "3600"))
+NOD_ARCHIVES_CACHE_DB_PATH = os.environ.get("NOD_ARCHIVES_CACHE_DB_PATH")
+NOD_ARCHIVES_CACHE_REFRESH_SECONDS = float(os.environ.get("NOD_ARCHIVES_CACHE_REFRESH_SECONDS", "60"))
+
+# Retrieved passages are deduped and reranked, then trimmed to roughly this many
+# tokens (0 for no limit) before they're handed to the model. Paragraphs whose
+# shingles overlap an earlier paragraph by at least the threshold are dropped.
+NOD_ARCHIVES_RESULT_MAX_TOKENS = int(os.environ.get("NOD_ARCHIVES_RESULT_MAX_TOKENS", "1200"))
+NOD_ARCHIVES_DEDUPE_THRESHOLD = float(os.environ.get("NOD_ARCHIVES_DEDUPE_THRESHOLD", "0.8"))
+
+# Hedged Retrieve calls: if a call takes longer than this percentile of recent
+# Retrieve latencies, a duplicate is sent and whichever answers first wins.
+# Hedges are spent from the same budget as retries (see utils/aws_clients.py).
+NOD_ARCHIVES_HEDGE_ENABLED = os.environ.get("NOD_ARCHIVES_HEDGE_ENABLED", "false").lower() == "true"
+NOD_ARCHIVES_HEDGE_PERCENTILE = float(os.environ.get("NOD_ARCHIVES_HEDGE_PERCENTILE", "95"))
+
+# Retriever which will retrieve info from our Nod Archives KB. Both backends
+# return the same top 5 `Document`s, so the rest of the tool doesn't care which
+# one is in use.
+if NOD_ARCHIVES_BACKEND == "local":
+    # The local index pulls in NumPy, which the bedrock backend has no use for,
+    # so it's only imported when it's actually the backend
+    from retrieval.local_index import LocalArchiveRetriever, DEFAULT_INDEX_DIR
 
-# Retriever which will retrieve info from our Nod Archives KB
-kb_retriever = AmazonKnowledgeBasesRetriever(
-    knowledge_base_id=os.environ["KNOWLEDGE_BASE_ID"],
-    retrieval_config={"vectorSearchConfiguration": {"numberOfResults": 5}}
+    kb_retriever = LocalArchiveRetriever.from_directory(
+        NOD_ARCHIVES_LOCAL_INDEX_DIR or DEFAULT_INDEX_DIR,
+        k=5,
+        keyword_weight=NOD_ARCHIVES_LOCAL_KEYWORD_WEIGHT,
+    )
+    # A rebuilt index gets a new fingerprint, which invalidates cached lookups
+    archives_source_id = f"local:{kb_retriever.index.fingerprint}"
+elif NOD_ARCHIVES_BACKEND == "bedrock":
+    kb_retriever = AmazonKnowledgeBasesRetriever(
+        knowledge_base_id=os.environ["KNOWLEDGE_BASE_ID"],
+        client=get_client("bedrock-agent-runtime"),
+        retrieval_config={"vectorSearchConfiguration": {"numberOfResults": 5}}
+    )
+    archives_source_id = os.environ["KNOWLEDGE_BASE_ID"]
+else:
+    raise ValueError(f"Unknown NOD_ARCHIVES_BACKEND: {NOD_ARCHIVES_BACKEND}")
+
+# boto3 has no async client, so the Retrieve call is blocking I/O. We run it on
+# a bounded thread pool of our own rather than on the event loop, otherwise a
+# single slow lookup would stall every other SSE stream served by this worker.
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=NOD_ARCHIVES_MAX_WORKERS,
+    thread_name_prefix="nod-archives",
+)
+
+# Hedged calls run on a pool of their own, so that a lookup waiting on its
+# hedge never waits for a free thread in the pool it's running on
+hedge_executor = ThreadPoolExecutor(
+    max_workers=NOD_ARCHIVES_MAX_WORKERS * 2,
+    thread_name_prefix="nod-archives-hedge",
+) if NOD_ARCHIVES_HEDGE_ENABLED and NOD_ARCHIVES_BACKEND == "bedrock" else None
+
+
+# Cache sitting in front of `kb_retriever`, since users keep asking about the
+# same units, factions and missions
+archives_cache = RetrievalCache(
+    namespace=archives_source_id,
+    max_entries=NOD_ARCHIVES_CACHE_MAX_ENTRIES,
+    ttl_seconds=NOD_ARCHIVES_CACHE_TTL_SECONDS,
+    db_path=NOD_ARCHIVES_CACHE_DB_PATH,
 )
 
-@tool
-def query_nod_archives(query: str) -> str:
+
+# When we last looked for a new KB sync (None until the first lookup)
+cache_refreshed_at: Optional[float] = None
+cache_refresh_lock = threading.Lock()
+
+
+def _latest_kb_sync() -> str:
+    """
+    Identifies the latest completed ingestion job of every data source of
+    the Nod Archives KB.
+    """
+    client = get_client("bedrock-agent")
+    knowledge_base_id = os.environ["KNOWLEDGE_BASE_ID"]
+    job_ids = []
+    for data_source in client.list_data_sources(knowledgeBaseId=knowledge_base_id)["dataSourceSummaries"]:
+        jobs = client.list_ingestion_jobs(
+            knowledgeBaseId=knowledge_base_id,
+            dataSourceId=data_source["dataSourceId"],
+            filters=[{"attribute": "STATUS", "operator": "EQ", "values": ["COMPLETE"]}],
+            sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"},
+            maxResults=1,
+        )["ingestionJobSummaries"]
+        job_ids.extend(job["ingestionJobId"] for job in jobs)
+    return ",".join(sorted(job_ids))
+
+
+def _refresh_cache_namespace() -> None:
+    """
+    Moves `archives_cache` to a new namespace once the KB has been re-synced,
+    so passages cached before the sync are never served again.
+    """
+    try:
+        namespace = f"{archives_source_id}:{_latest_kb_sync()}"
+        if namespace != archives_cache.namespace:
+            archives_cache.invalidate(namespace)
+    except Exception as e:
+        # We keep serving the cache as is, and try again next interval
+        print(f"CABAL Exception: {str(e)}")
+
+
+def _maybe_refresh_cache_namespace(inline: bool = False) -> None:
+    """
+    Checks for a new KB sync if the refresh interval is up. This runs before
+    every lookup, cache hits included, and never blocks unless `inline` is
+    set: the check itself runs on `retrieval_executor`.
+
+    With a persistent tier, the very first check runs inline (from a lookup
+    that's already on the pool), since SQLite may hold lookups from before a
+    sync that happened while this worker was down. The in-memory tier starts
+    out empty, so without SQLite there's nothing stale to wait on.
+    """
+    global cache_refreshed_at
+    if NOD_ARCHIVES_BACKEND != "bedrock" or NOD_ARCHIVES_CACHE_REFRESH_SECONDS <= 0:
+        return
+
+    # Most lookups land well within the interval, so they skip the lock altogether
+    refreshed_at = cache_refreshed_at
+    if refreshed_at is not None and time.monotonic() - refreshed_at < NOD_ARCHIVES_CACHE_REFRESH_SECONDS:
+        return
+
+    # Only an inline check waits on the lock; anyone else (e.g. the event loop)
+    # leaves it to whoever already holds it
+    if not cache_refresh_lock.acquire(blocking=inline):
+        return
+    try:
+        if cache_refreshed_at is None and NOD_ARCHIVES_CACHE_DB_PATH:
+            if not inline:
+                # The lookup that reads SQLite first runs the check before it does
+                return
+            _refresh_cache_namespace()
+        elif cache_refreshed_at is None or time.monotonic() - cache_refreshed_at >= NOD_ARCHIVES_CACHE_REFRESH_SECONDS:
+            retrieval_executor.submit(_refresh_cache_namespace)
+        else:
+            return
+        cache_refreshed_at = time.monotonic()
+    finally:
+        cache_refresh_lock.release()
+
+
+def _lookup(query: str) -> List[Document]:
+    """
+    Looks a query up in the cache (both tiers) and falls back to the KB.
+    Blocks on I/O, so it runs on `retrieval_executor`.
     """
-    Use this tool to look up information about the Tiberian Sun universe. This includes 
+    _maybe_refresh_cache_namespace(inline=True)
+    cached = archives_cache.get(query)
+    if cached is not None:
+        return cached
+    return _retrieve(query)
+
+
+def _retrieve(query: str) -> List[Document]:
+    """
+    Runs a single blocking lookup against the Nod Archives KB and caches the result.
+    """
+    if hedge_executor:
+        archive_results = call_hedged(
+            lambda: kb_retriever.invoke(query),
+            hedge_executor,
+            get_latency_histogram("bedrock-agent-runtime"),
+            percentile=NOD_ARCHIVES_HEDGE_PERCENTILE,
+        )
+    else:
+        archive_results = kb_retriever.invoke(query)
+    archives_cache.set(query, archive_results)
+    return archive_results
+
+
+def _collect_queries(query: str, sub_queries: Optional[List[str]]) -> List[str]:
+    """
+    Builds the list of distinct queries to run, with the main query first.
+    """
+    queries = [query]
+    for sub_query in (sub_queries or [])[:NOD_ARCHIVES_MAX_SUB_QUERIES]:
+        if sub_query and sub_query not in queries:
+            queries.append(sub_query)
+    return queries
+
+
+def _merge_results(results: List[List[Document]]) -> List[Document]:
+    """
+    Interleaves the ranked results of each query and drops duplicate passages.
+
+    Interleaving by rank (1st hit of every query, then 2nd hits, ...) keeps the
+    best match of each sub-query near the top instead of letting the main query
+    crowd them out.
+    """
+    merged = []
+    seen = set()
+    for rank in range(max((len(docs) for docs in results), default=0)):
+        for docs in results:
+            if rank >= len(docs):
+                continue
+            doc = docs[rank]
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            merged.append(doc)
+    return merged
+
+
+def _format_results(queries: List[str], results: List[List[Document]], errors: List[Exception]) -> str:
+    """
+    Combines the results into a single string for the model to interpret.
+
+    Every passage is followed by its source, so the model can still cite the
+    archives after passages have been cut down. If only some lookups failed,
+    the results are still returned, under a warning line; the model learns
+    they may be incomplete, and the run's answer isn't cached.
+    """
+    # Only surface an error if every lookup failed; partial results are still useful
+    if errors and not results:
+        return f"{TOOL_ERROR_PREFIX}: {str(errors[0])}"
+
+    # Passages are reranked against every query, so sub-query hits aren't penalised
+    archive_results = compress_passages(
+        " ".join(queries),
+        _merge_results(results),
+        max_tokens=NOD_ARCHIVES_RESULT_MAX_TOKENS,
+        dedupe_threshold=NOD_ARCHIVES_DEDUPE_THRESHOLD,
+    )
+    output = (
+        "\n\n".join([_format_passage(doc) for doc in archive_results])
+        or "No matching records found in Nod archives."
+    )
+
+    if errors:
+        warning = f"{TOOL_WARNING_PREFIX}: {len(errors)} of {len(queries)} lookups failed ({str(errors[0])}); these records may be incomplete."
+        output = f"{warning}\n\n{output}"
+    return output
+
+
+def _format_passage(doc: Document) -> str:
+    url = source_url(doc)
+    return f"{doc.page_content}\nSOURCE: {url}" if url else doc.page_content
+
+
+def _query_nod_archives(query: str, sub_queries: Optional[List[str]] = None) -> str:
+    """
+    Use this tool to look up information about the Tiberian Sun universe. This includes
     information about:
      - Factions (e.g. Nod, GDI, The Forgotten, The Scrin)
      - Key characters (e.g. Kane, Anton Slavik, Michael McNeil)
      - Units (e.g. Light Infantry, Harvester, Cyborg)
-     - Buildings (e.g. Power Plant, Hand of Nod, War Factory) 
+     - Buildings (e.g. Power Plant, Hand of Nod, War Factory)
 
     This also includes information about the events from the Tiberian Sun: Firestorm expansion pack.
-      
+
     Always use this tool if the user asks a specific question about the Tiberian Sun universe.
+
+    If the question covers several subjects (e.g. comparing two units), pass one focused
+    reformulation per subject in `sub_queries`. These are looked up at the same time as
+    `query` and the results are merged.
     """
-    try:
-        # The retriever returns a list of 'Document' objects.
-        archive_results = kb_retriever.invoke(query)
-        
-        if not archive_results:
-            return "No matching records found in Nod archives."
-            
-        # Combine the results into a single string for the model to interpret
-        combined_text = "\n\n".join([doc.page_content for doc in archive_results])
-        return combined_text
-        
-    except Exception as e:
-        return f"CODEX_ERROR: {str(e)}"
+    queries = _collect_queries(query, sub_queries)
+    results, errors, futures = [], [], []
+    _maybe_refresh_cache_namespace()
+    for q in queries:
+        cached = archives_cache.get_memory(q)
+        if cached is not None:
+            results.append(cached)
+        else:
+            futures.append(retrieval_executor.submit(_lookup, q))
+    wait(futures, timeout=NOD_ARCHIVES_TIMEOUT_SECONDS)
+
+    for future in futures:
+        if not future.done():
+            future.cancel()
+            errors.append(TimeoutError("Nod archives lookup timed out."))
+        elif future.exception():
+            errors.append(future.exception())
+        else:
+            results.append(future.result())
+
+    return _format_results(queries, results, errors)
+
+
+async def _aretrieve(q: str) -> List[Document]:
+    # In-memory cache hits are served straight from the loop without a thread
+    # hop; the persistent tier is SQLite, so it's read from the pool
+    _maybe_refresh_cache_namespace()
+    cached = archives_cache.get_memory(q)
+    if cached is not None:
+        return cached
+
+    # Note that a timed out lookup still finishes in its pool thread; we just
+    # stop waiting on it
+    return await asyncio.wait_for(
+        asyncio.get_running_loop().run_in_executor(retrieval_executor, _lookup, q),
+        timeout=NOD_ARCHIVES_TIMEOUT_SECONDS,
+    )
+
+
+async def _aquery_nod_archives(query: str, sub_queries: Optional[List[str]] = None) -> str:
+    async def retrieve(q: str) -> List[Document]:
+        # If this run prefetched a matching lookup, we pick up where it left off
+        prefetched = take_prefetched(q)
+        if prefetched is not None:
+            return await asyncio.shield(prefetched)
+        return await _aretrieve(q)
+
+    queries = _collect_queries(query, sub_queries)
+    outcomes = await asyncio.gather(
+        *[retrieve(q) for q in queries],
+        return_exceptions=True,
+    )
+
+    results, errors = [], []
+    for outcome in outcomes:
+        if isinstance(outcome, asyncio.TimeoutError):
+            errors.append(TimeoutError("Nod archives lookup timed out."))
+        elif isinstance(outcome, Exception):
+            errors.append(outcome)
+        else:
+            results.append(outcome)
+
+    return _format_results(queries, results, errors)
+
+
+def prefetch_nod_archives(query: str) -> ArchivePrefetch:
+    """
+    Starts looking up `query` in the background, ahead of any tool call.
+
+    Must be called from a running event loop. Set the returned prefetch as the
+    run's `active_prefetch` so the tool can pick it up, and close it once the
+    run is over.
+    """
+    return ArchivePrefetch(query, asyncio.ensure_future(_aretrieve(query)))
+
+
+# We register both a sync and an async implementation. The agent runs inside
+# `astream_events`, so it goes through the async path and never blocks the loop.
+query_nod_archives = StructuredTool.from_function(
+    func=_query_nod_archives,
+    coroutine=_aquery_nod_archives,
+    name="query_nod_archives",
+)
@@ -1,3 +1,70 @@
-from .sse import format_sse, SSEEventType
+from .sse import format_sse, encode_sse, extract_text, SSEEventType
+from .coalesce import coalesce_events
+from .text import (
+    normalize_query,
+    tokenize,
+    estimate_tokens,
+    bm25_idf,
+    bm25_term_weight,
+    CHARS_PER_TOKEN,
+)
+from .tiered_cache import TieredCache, drain_cache_metrics
+from .response_cache import ResponseCache, replay_events
+from .usage import TokenUsage
+from .metrics import RequestMetrics, emf_record, TOOL_ERROR_PREFIX, TOOL_WARNING_PREFIX
+from .cancellation import ClientDisconnected, wait_for_disconnect, until_disconnected
+from .admission import AdmissionController
+from .batching import parse_batch_line, bounded_map
+from .sessions import SessionStore, window_history, summarize_turns
+from .stream_buffer import StreamBuffer, StreamRegistry, StreamGap
+from .aws_clients import (
+    RetryBudget,
+    LatencyHistogram,
+    retry_budget,
+    get_client,
+    get_latency_histogram,
+    call_hedged,
+    drain_client_metrics,
+)
 
-__all__ = ["format_sse", "SSEEventType"]
+__all__ = [
+    "format_sse",
+    "encode_sse",
+    "extract_text",
+    "SSEEventType",
+    "coalesce_events",
+    "normalize_query",
+    "tokenize",
+    "estimate_tokens",
+    "bm25_idf",
+    "bm25_term_weight",
+    "CHARS_PER_TOKEN",
+    "TieredCache",
+    "drain_cache_metrics",
+    "ResponseCache",
+    "replay_events",
+    "TokenUsage",
+    "RequestMetrics",
+    "emf_record",
+    "TOOL_ERROR_PREFIX",
+    "TOOL_WARNING_PREFIX",
+    "ClientDisconnected",
+    "wait_for_disconnect",
+    "until_disconnected",
+    "AdmissionController",
+    "parse_batch_line",
+    "bounded_map",
+    "SessionStore",
+    "window_history",
+    "summarize_turns",
+    "StreamBuffer",
+    "StreamRegistry",
+    "StreamGap",
+    "RetryBudget",
+    "LatencyHistogram",
+    "retry_budget",
+    "get_client",
+    "get_latency_histogram",
+    "call_hedged",
+    "drain_client_metrics",
+]
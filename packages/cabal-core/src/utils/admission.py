@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+
+class AdmissionController:
+    """
+    Caps the number of agent runs in flight on this worker.
+
+    Requests over the limit wait in line for up to `queue_timeout_seconds`
+    and are rejected if no slot frees up in time (or straight away, if the
+    timeout is 0). This way a traffic spike sheds load early instead of
+    piling every request onto Bedrock until they all hit the Lambda timeout.
+    """
+
+    def __init__(self, max_concurrent: int, queue_timeout_seconds: float):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._semaphore = asyncio.Semaphore(max(max_concurrent, 1))
+        self._counters = {"admitted": 0, "rejected": 0, "queued": 0, "running": 0}
+
+    async def acquire(self, queue_timeout_seconds: Optional[float] = None) -> bool:
+        """
+        Waits for a slot. Returns False if the request should be rejected.
+
+        `queue_timeout_seconds` overrides the default wait, e.g. for batch
+        items that would rather wait than fail.
+        """
+        if queue_timeout_seconds is None:
+            queue_timeout_seconds = self.queue_timeout_seconds
+
+        # A limit of 0 (or less) means no limit at all
+        if self.max_concurrent <= 0:
+            self._admit()
+            return True
+
+        if not self._semaphore.locked():
+            # A free slot is taken straight away, without suspending
+            await self._semaphore.acquire()
+        elif queue_timeout_seconds <= 0:
+            self._counters["rejected"] += 1
+            return False
+        else:
+            self._counters["queued"] += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=queue_timeout_seconds)
+            except asyncio.TimeoutError:
+                self._counters["rejected"] += 1
+                return False
+
+        self._admit()
+        return True
+
+    def release(self) -> None:
+        self._counters["running"] -= 1
+        if self.max_concurrent > 0:
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "max_concurrent": self.max_concurrent}
+
+    def _admit(self) -> None:
+        self._counters["admitted"] += 1
+        self._counters["running"] += 1
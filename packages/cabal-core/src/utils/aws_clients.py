@@ -0,0 +1,304 @@
+import bisect
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+from .metrics import emf_record
+
+T = TypeVar("T")
+
+# Connection pool and timeouts shared by every AWS client on this worker.
+# boto3's default pool of 10 connections is smaller than the number of
+# Retrieve and Converse calls we can have in flight, and its 60s connect
+# timeout is far longer than we'd ever want to wait for a TCP handshake.
+CABAL_AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("CABAL_AWS_MAX_POOL_CONNECTIONS", "50"))
+CABAL_AWS_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("CABAL_AWS_CONNECT_TIMEOUT_SECONDS", "2"))
+CABAL_AWS_READ_TIMEOUT_SECONDS = float(os.environ.get("CABAL_AWS_READ_TIMEOUT_SECONDS", "60"))
+
+# botocore's retry mode and max attempts (first try included). "adaptive"
+# also rate limits the client client-side once Bedrock starts throttling.
+CABAL_AWS_RETRY_MODE = os.environ.get("CABAL_AWS_RETRY_MODE", "adaptive")
+CABAL_AWS_MAX_ATTEMPTS = int(os.environ.get("CABAL_AWS_MAX_ATTEMPTS", "3"))
+
+# Retry budget shared by every client: each call earns `ratio` of a retry,
+# up to a burst of `max_tokens` retries. Hedged requests count as retries.
+CABAL_AWS_RETRY_BUDGET_RATIO = float(os.environ.get("CABAL_AWS_RETRY_BUDGET_RATIO", "0.1"))
+CABAL_AWS_RETRY_BUDGET_MAX_TOKENS = float(os.environ.get("CABAL_AWS_RETRY_BUDGET_MAX_TOKENS", "10"))
+
+# Latency histogram buckets grow by this factor, from 1ms up to ~2 minutes,
+# which keeps them under EMF's limit of 100 distinct values per metric
+LATENCY_BUCKET_GROWTH = 1.25
+LATENCY_BUCKET_BOUNDS_MS = [LATENCY_BUCKET_GROWTH ** i for i in range(54)]
+
+# Percentiles are taken over this many of the latest calls, and only once a
+# client has seen enough of them to be meaningful
+LATENCY_WINDOW_SIZE = 1000
+LATENCY_MIN_SAMPLES = 20
+
+
+class RetryBudget:
+    """
+    A token bucket which caps retries across every client on this worker.
+
+    botocore's own retry quota is per client, and it lets every call retry
+    as long as most calls succeed. When Bedrock has a slow spell, that turns
+    into a burst of retries on top of the calls that are already struggling.
+    With a budget, retries (and hedged requests) can only add up to `ratio`
+    of the calls we make, plus a small burst of `max_tokens`.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """
+        Takes a token for a retry. Returns False if the budget is spent.
+        """
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def refund(self) -> None:
+        """
+        Gives back a token taken for a retry that didn't happen.
+        """
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + 1)
+
+
+class LatencyHistogram:
+    """
+    Latencies of one client's API calls.
+
+    Calls are counted into log-spaced buckets, which are drained into an EMF
+    record after every request. Percentiles (e.g. the hedging delay) come
+    from a sliding window of the latest calls, so they follow Bedrock's
+    latency as it drifts over the life of a worker.
+    """
+
+    def __init__(self, window_size: int = LATENCY_WINDOW_SIZE):
+        self._lock = threading.Lock()
+        self._recent: "deque[float]" = deque(maxlen=window_size)
+        self._buckets: Dict[int, int] = {}
+        self._counters = {"calls": 0, "errors": 0, "retries": 0, "retries_denied": 0, "hedges": 0}
+
+    def observe(self, latency_ms: float, error: bool = False) -> None:
+        with self._lock:
+            self._recent.append(latency_ms)
+            bucket = bisect.bisect_left(LATENCY_BUCKET_BOUNDS_MS, latency_ms)
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+            self._counters["calls"] += 1
+            self._counters["errors"] += int(error)
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Returns the given percentile of the latest latencies in milliseconds,
+        or None if there haven't been enough calls yet.
+        """
+        with self._lock:
+            if len(self._recent) < LATENCY_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * percent / 100) - 1)]
+
+    def drain(self) -> Dict[str, Any]:
+        """
+        Returns the bucketed latencies and counters since the last drain, and
+        resets them.
+        """
+        with self._lock:
+            buckets, self._buckets = self._buckets, {}
+            counters = dict(self._counters)
+            self._counters = {name: 0 for name in counters}
+
+        # Each bucket is reported as its upper bound (capped at the last one)
+        bounds = [LATENCY_BUCKET_BOUNDS_MS[min(b, len(LATENCY_BUCKET_BOUNDS_MS) - 1)] for b in buckets]
+        return {
+            **counters,
+            "values": [round(bound, 1) for bound in bounds],
+            "counts": list(buckets.values()),
+        }
+
+
+retry_budget = RetryBudget(ratio=CABAL_AWS_RETRY_BUDGET_RATIO, max_tokens=CABAL_AWS_RETRY_BUDGET_MAX_TOKENS)
+
+_clients: Dict[str, Any] = {}
+_client_locks: Dict[str, threading.Lock] = {}
+_histograms: Dict[str, LatencyHistogram] = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name: str) -> Any:
+    """
+    Returns this worker's shared boto3 client for an AWS service.
+
+    Clients are thread-safe and hold their own connection pool, so one per
+    service is all we need; creating more just means more cold TLS
+    handshakes. Every client gets our pool size and timeouts, keep-alive,
+    retries under the shared `retry_budget`, and a latency histogram.
+    """
+    # Each service has its own lock, so different clients can be created side
+    # by side (e.g. the model client and the KB retriever in `build_agent`)
+    with _lock:
+        client_lock = _client_locks.setdefault(service_name, threading.Lock())
+    with client_lock:
+        if service_name not in _clients:
+            _clients[service_name] = _create_client(service_name)
+    return _clients[service_name]
+
+
+def get_latency_histogram(service_name: str) -> LatencyHistogram:
+    with _lock:
+        return _histograms.setdefault(service_name, LatencyHistogram())
+
+
+def call_hedged(
+    func: Callable[[], T],
+    executor: Executor,
+    histogram: LatencyHistogram,
+    percentile: float = 95,
+) -> T:
+    """
+    Calls `func` on `executor` and, if it hasn't answered within the
+    `percentile` latency of its client, calls it a second time. Whichever
+    call succeeds first wins.
+
+    Hedges are spent from the shared `retry_budget`, so they can't snowball
+    when the service is slow across the board. Until the client has a
+    latency history, calls aren't hedged. The losing call can't be aborted
+    mid-flight; it finishes in the background and its result is dropped.
+    """
+    first = executor.submit(func)
+    delay_ms = histogram.percentile(percentile)
+    if delay_ms is None:
+        return first.result()
+
+    done, _ = wait([first], timeout=delay_ms / 1000)
+    if done:
+        return first.result()
+    if not retry_budget.try_spend():
+        histogram.count("retries_denied")
+        return first.result()
+
+    histogram.count("hedges")
+    pending = {first, executor.submit(func)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+def drain_client_metrics() -> List[Dict[str, Any]]:
+    """
+    Formats each client's latency histogram since the last call as a
+    CloudWatch EMF record, with the client's service as a dimension.
+    Clients without any calls since then are left out.
+    """
+    with _lock:
+        histograms = dict(_histograms)
+
+    records = []
+    for service_name, histogram in histograms.items():
+        summary = histogram.drain()
+        if not summary["calls"]:
+            continue
+        records.append(emf_record(
+            {
+                "ClientLatency": ({"Values": summary["values"], "Counts": summary["counts"]}, "Milliseconds"),
+                "ClientErrors": (summary["errors"], "Count"),
+                "ClientRetries": (summary["retries"], "Count"),
+                "ClientRetriesDenied": (summary["retries_denied"], "Count"),
+                "ClientHedges": (summary["hedges"], "Count"),
+            },
+            dimensions={"Client": service_name},
+        ))
+    return records
+
+
+def _create_client(service_name: str) -> Any:
+    # Imported lazily, since boto3 makes up a good part of our cold start
+    import boto3
+    from botocore.config import Config
+    from botocore.retries import standard
+
+    # Each client gets a session of its own, since boto3's default session
+    # isn't safe to create clients from on several threads at once
+    client = boto3.session.Session().client(service_name, config=Config(
+        max_pool_connections=CABAL_AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=CABAL_AWS_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=CABAL_AWS_READ_TIMEOUT_SECONDS,
+        tcp_keepalive=True,
+        retries={"mode": CABAL_AWS_RETRY_MODE, "total_max_attempts": CABAL_AWS_MAX_ATTEMPTS},
+    ))
+
+    events = client.meta.events
+    service_id = client.meta.service_model.service_id.hyphenize()
+    histogram = get_latency_histogram(service_name)
+
+    # Whole API calls are timed, retries and backoff included. For streaming
+    # calls (e.g. ConverseStream), botocore is done once the response headers
+    # are in, so this is the time to the first byte; the time spent streaming
+    # the answer is the request's ModelTime instead.
+    def on_before_call(context, **kwargs):
+        context["cabal_started_at"] = time.perf_counter()
+        retry_budget.record_call()
+
+    def on_after_call(context, http_response=None, exception=None, **kwargs):
+        started_at = context.get("cabal_started_at")
+        if started_at is not None:
+            failed = exception is not None or http_response is None or http_response.status_code >= 300
+            histogram.observe((time.perf_counter() - started_at) * 1000, error=failed)
+
+    events.register(f"before-call.{service_id}", on_before_call)
+    events.register(f"after-call.{service_id}", on_after_call)
+    events.register(f"after-call-error.{service_id}", on_after_call)
+
+    if CABAL_AWS_RETRY_MODE in ("standard", "adaptive"):
+        # We swap botocore's retry handler for one that also checks the
+        # shared budget. It still decides what's retryable and how long to
+        # back off. The budget is checked first, since botocore takes from
+        # its own per-client quota as soon as it decides to retry, and only
+        # gives it back once a later attempt succeeds; a retry we refused
+        # after that would drain the client's quota for good.
+        unique_id = f"retry-config-{service_id}"
+        events.unregister(f"needs-retry.{service_id}", unique_id=unique_id)
+        handler = standard.register_retry_handler(client, max_attempts=CABAL_AWS_MAX_ATTEMPTS)
+        events.unregister(f"needs-retry.{service_id}", unique_id=unique_id)
+
+        def needs_retry(response=None, caught_exception=None, **kwargs):
+            failed = caught_exception is not None or (response is not None and response[0].status_code >= 300)
+            if failed and not retry_budget.try_spend():
+                histogram.count("retries_denied")
+                return None
+
+            delay = handler.needs_retry(response=response, caught_exception=caught_exception, **kwargs)
+            if failed and delay is None:
+                # Not retryable (or out of attempts) after all
+                retry_budget.refund()
+            elif delay is not None:
+                histogram.count("retries")
+            return delay
+
+        events.register(f"needs-retry.{service_id}", needs_retry, unique_id=unique_id)
+
+    return client
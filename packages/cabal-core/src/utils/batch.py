@@ -0,0 +1,58 @@
+"""
+Runs a JSONL file of prompts through a CABAL Core's /chat/batch endpoint.
+
+Usage (from packages/cabal-core/src):
+
+    python -m utils.batch --url http://localhost:8080 --input prompts.jsonl > results.jsonl
+
+Each input line is a JSON object with a "message" and an optional "id". Each
+output line is the result of one prompt (see `run_batch_item` in cabal.py),
+written as soon as it completes, so results may come back out of order. A
+summary is printed to stderr at the end.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import urllib.parse
+import urllib.request
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts against /chat/batch.")
+    parser.add_argument("--url", default="http://localhost:8080", help="Base URL of CABAL Core")
+    parser.add_argument("--input", required=True, help="JSONL file of prompts")
+    parser.add_argument("--concurrency", type=int, help="Prompts run at once (capped by the server)")
+    parser.add_argument("--timeout", type=float, help="Per-prompt timeout in seconds")
+    args = parser.parse_args()
+
+    params = {"concurrency": args.concurrency, "timeout_seconds": args.timeout}
+    query = urllib.parse.urlencode({key: value for key, value in params.items() if value is not None})
+    url = f"{args.url.rstrip('/')}/chat/batch" + (f"?{query}" if query else "")
+
+    results, errors, totals = 0, 0, []
+    with open(args.input, "rb") as f:
+        request = urllib.request.Request(
+            url,
+            data=f,
+            headers={"Content-Type": "application/x-ndjson", "Content-Length": str(os.path.getsize(args.input))},
+        )
+        # Results are relayed line by line as the server streams them
+        with urllib.request.urlopen(request) as response:
+            for line in response:
+                sys.stdout.write(line.decode("utf-8"))
+                sys.stdout.flush()
+                result = json.loads(line)
+                results += 1
+                errors += bool(result.get("error"))
+                if result.get("metrics"):
+                    totals.append(result["metrics"]["total_ms"])
+
+    summary = {
+        "results": results,
+        "errors": errors,
+        "total_ms_p50": round(statistics.median(totals), 1) if totals else None,
+        "total_ms_max": max(totals, default=None),
+    }
+    print(f"[CABAL Batch] {json.dumps(summary)}", file=sys.stderr)
@@ -0,0 +1,57 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def parse_batch_line(number: int, line: bytes) -> Dict[str, Any]:
+    """
+    Parses one JSONL line into a batch item. Malformed lines become items
+    with an "error", so they're reported alongside the other results.
+    """
+    try:
+        item = json.loads(line)
+        if not isinstance(item, dict) or not isinstance(item.get("message"), str):
+            raise ValueError('Expected an object with a "message" string')
+    except ValueError as e:
+        return {"id": number, "error": f"Invalid batch line {number}: {str(e)}"}
+    return {"id": item.get("id", number), "message": item["message"]}
+
+
+async def bounded_map(
+    items: Iterable[T],
+    func: Callable[[T], Awaitable[R]],
+    concurrency: int,
+) -> AsyncIterator[R]:
+    """
+    Applies `func` to every item with at most `concurrency` calls in flight,
+    yielding results in the order they complete.
+
+    Items are only pulled from `items` as slots free up, and results are
+    handed off as soon as they're ready, so memory use depends on
+    `concurrency` rather than on the number of items. Closing the iterator
+    early cancels the calls still in flight.
+    """
+    iterator = iter(items)
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                item = next(iterator, None)
+                if item is None:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(func(item)))
+
+            if not pending:
+                return
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,65 @@
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """
+    Raised when the client hangs up before the stream completes.
+    """
+
+
+async def wait_for_disconnect(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    """
+    Returns once the ASGI server reports that the client has disconnected.
+
+    Must only be awaited after the request body has been read, since it
+    consumes (and discards) any other incoming messages.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def until_disconnected(
+    events: AsyncIterator[T],
+    disconnected: "asyncio.Future[Any]",
+) -> AsyncIterator[T]:
+    """
+    Relays `events` until `disconnected` completes.
+
+    We race every step of the source against the disconnect, rather than only
+    checking between events, so a client that hangs up in the middle of a
+    long tool call or model turn stops that work right away. The in-flight
+    step is cancelled, which unwinds the source (and everything it awaits),
+    and `ClientDisconnected` is raised.
+    """
+    iterator = events.__aiter__()
+    next_event = None
+    try:
+        while True:
+            next_event = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+
+            if not next_event.done():
+                raise ClientDisconnected()
+
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        # We may also get here by being cancelled ourselves (e.g. by the ASGI
+        # server), so make sure the in-flight step is unwound before closing
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
+            with contextlib.suppress(BaseException):
+                await next_event
+
+        aclose = getattr(iterator, "aclose", None)
+        if aclose:
+            await aclose()
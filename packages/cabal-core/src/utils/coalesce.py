@@ -0,0 +1,92 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Tuple
+from .sse import SSEEventType
+
+# A (event type, data) pair on its way to being encoded as an SSE
+StreamEvent = Tuple[SSEEventType, Any]
+
+
+async def coalesce_events(
+    events: AsyncIterator[StreamEvent],
+    window_seconds: float = 0.03,
+    max_bytes: int = 1024,
+) -> AsyncIterator[StreamEvent]:
+    """
+    Batches consecutive MESSAGE events into fewer, larger ones.
+
+    Models stream a handful of characters per chunk, and writing each one as
+    its own SSE means one tiny frame (and syscall) per token. Instead, we
+    buffer message text and flush it once it has been held for
+    `window_seconds` or has grown past `max_bytes`. The first message after
+    the start of the stream (or after any other event, like a tool call) is
+    flushed immediately, so time to first token is unaffected.
+
+    Non-MESSAGE events are never delayed; they flush any buffered text ahead
+    of themselves to preserve ordering.
+
+    Args:
+        events: The source of (event type, data) pairs.
+        window_seconds: Max time to hold buffered text, or 0 to disable coalescing.
+        max_bytes: Max size of buffered text before it is flushed.
+    """
+    if window_seconds <= 0:
+        async for event in events:
+            yield event
+        return
+
+    iterator = events.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+    flush_next = True
+    pending = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            # Wait for the next event, but no longer than the buffer may be held.
+            # We never cancel `pending` on a timeout since that would cancel the source.
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                yield SSEEventType.MESSAGE, "".join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+                continue
+
+            task, pending = pending, None
+            try:
+                event_type, data = task.result()
+            except StopAsyncIteration:
+                break
+
+            if event_type == SSEEventType.MESSAGE and isinstance(data, str):
+                if flush_next:
+                    flush_next = False
+                    yield event_type, data
+                    continue
+
+                buffer.append(data)
+                buffered_bytes += len(data.encode("utf-8"))
+                if deadline is None:
+                    deadline = time.monotonic() + window_seconds
+                if buffered_bytes >= max_bytes:
+                    yield SSEEventType.MESSAGE, "".join(buffer)
+                    buffer, buffered_bytes, deadline = [], 0, None
+                continue
+
+            if buffer:
+                yield SSEEventType.MESSAGE, "".join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+            flush_next = True
+            yield event_type, data
+
+        if buffer:
+            yield SSEEventType.MESSAGE, "".join(buffer)
+    finally:
+        # The consumer may stop early (e.g. on error), so don't leave the source dangling
+        if pending is not None:
+            pending.cancel()
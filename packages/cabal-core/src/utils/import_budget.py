@@ -0,0 +1,59 @@
+"""
+Summarizes `python -X importtime` for a module and checks it against a budget.
+
+Usage (from packages/cabal-core/src):
+
+    python -m utils.import_budget --module cabal --budget-ms 1500
+
+The import runs in a fresh interpreter with the current environment, so set
+CABAL_STARTUP_MODE (and the usual MODEL_ID, KNOWLEDGE_BASE_ID, etc.) to
+measure the startup mode you actually deploy. Exits with status 1 if the
+import takes longer than the budget.
+"""
+import argparse
+import subprocess
+import sys
+from typing import Dict, Tuple
+
+
+def measure_import(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Imports `module` in a subprocess and returns the total import time along
+    with the time spent per top-level package, both in milliseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    packages: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+
+    return sum(packages.values()), packages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a module's import time against a budget.")
+    parser.add_argument("--module", default="cabal", help="Module to import")
+    parser.add_argument("--budget-ms", type=float, required=True, help="Max total import time")
+    parser.add_argument("--top", type=int, default=15, help="Number of packages to list")
+    args = parser.parse_args()
+
+    total_ms, packages = measure_import(args.module)
+
+    print(f"[CABAL Startup] Importing {args.module} took {total_ms:.0f}ms (budget: {args.budget_ms:.0f}ms)")
+    for package, package_ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {package_ms:8.1f}ms  {package_ms / total_ms:6.1%}  {package}")
+
+    if total_ms > args.budget_ms:
+        print(f"[CABAL Startup] Import time over budget by {total_ms - args.budget_ms:.0f}ms")
+        sys.exit(1)
@@ -0,0 +1,201 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from .text import estimate_tokens
+from .usage import TokenUsage
+
+# CloudWatch namespace our Embedded Metric Format (EMF) logs publish to
+METRICS_NAMESPACE = "CABAL"
+
+# Tool whose duration and output size we break out as retrieval metrics
+RETRIEVAL_TOOL_NAME = "query_nod_archives"
+
+# Prefixes of the tool output when every archives lookup failed, or only some
+# of them did and the results are incomplete (see query_nod_archives)
+TOOL_ERROR_PREFIX = "CODEX_ERROR"
+TOOL_WARNING_PREFIX = "CODEX_WARNING"
+
+
+class RequestMetrics:
+    """
+    Latency and token metrics for a single /chat request.
+
+    Metrics are derived from the `astream_events` events that the agent
+    already emits: model and tool runs are timed between their `*_start` and
+    `*_end` events, matched up by run ID.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.usage = TokenUsage()
+        self.model_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.disconnected = False
+        # Set if any tool call failed, even partly, e.g. an archives sub-query timed out
+        self.tool_failed = False
+        # "hits", "misses" or "unused" if the run prefetched from the archives
+        self.prefetch_outcome: Optional[str] = None
+        # Session history sent to the model, for requests that belong to a session
+        self.history_turns: Optional[int] = None
+        self.history_tokens: Optional[int] = None
+        self.history_dropped_turns: Optional[int] = None
+        self.session_evictions: Optional[int] = None
+        self.session_store_bytes: Optional[int] = None
+        self.tool_calls: List[Dict[str, Any]] = []
+        self._runs: Dict[str, float] = {}
+
+    def mark_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def observe(self, event: Dict[str, Any]) -> None:
+        """
+        Updates the metrics with a single `astream_events` event.
+        """
+        kind = event["event"]
+        run_id = event.get("run_id")
+
+        if kind in ("on_chat_model_start", "on_tool_start"):
+            self._runs[run_id] = time.perf_counter()
+
+        elif kind == "on_chat_model_end":
+            started_at = self._runs.pop(run_id, None)
+            if started_at is not None:
+                self.model_seconds += time.perf_counter() - started_at
+            self.usage.add(getattr(event["data"].get("output"), "usage_metadata", None))
+
+        elif kind == "on_tool_error":
+            self._runs.pop(run_id, None)
+            self.tool_failed = True
+
+        elif kind == "on_tool_end":
+            output = event["data"].get("output")
+            content = str(getattr(output, "content", output) or "")
+            if content.startswith((TOOL_ERROR_PREFIX, TOOL_WARNING_PREFIX)):
+                self.tool_failed = True
+
+            started_at = self._runs.pop(run_id, None)
+            if started_at is None:
+                return
+            self.tool_calls.append({
+                "name": event.get("name", "UNKNOWN_PROGRAM"),
+                "duration_ms": round((time.perf_counter() - started_at) * 1000, 1),
+                "output_chars": len(content),
+            })
+
+    def observe_history(self, window: List[Any], dropped: List[Any]) -> None:
+        """
+        Records how much of the session's history was sent to the model.
+        """
+        self.history_turns = len(window)
+        self.history_tokens = sum(estimate_tokens(text) for _, text in window)
+        self.history_dropped_turns = len(dropped)
+
+    def finish(self) -> None:
+        self.finished_at = time.perf_counter()
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Returns a summary of the request's metrics. Times are in milliseconds.
+        """
+        finished_at = self.finished_at or time.perf_counter()
+        retrieval_calls = [call for call in self.tool_calls if call["name"] == RETRIEVAL_TOOL_NAME]
+
+        return {
+            "time_to_first_token_ms": _ms(self.first_token_at - self.started_at) if self.first_token_at else None,
+            "total_ms": _ms(finished_at - self.started_at),
+            "model_ms": _ms(self.model_seconds),
+            "queue_ms": _ms(self.queue_seconds),
+            "tool_ms": round(sum(call["duration_ms"] for call in self.tool_calls), 1),
+            "retrieval_ms": round(sum(call["duration_ms"] for call in retrieval_calls), 1),
+            "retrieval_result_chars": sum(call["output_chars"] for call in retrieval_calls),
+            "output_tokens_per_second": (
+                round(self.usage.output_tokens / self.model_seconds, 1) if self.model_seconds else None
+            ),
+            **self.usage.as_dict(),
+            "disconnected": self.disconnected,
+            "prefetch_outcome": self.prefetch_outcome,
+            "history_turns": self.history_turns,
+            "history_tokens": self.history_tokens,
+            "history_dropped_turns": self.history_dropped_turns,
+            "session_evictions": self.session_evictions,
+            "session_store_bytes": self.session_store_bytes,
+            "tool_calls": self.tool_calls,
+        }
+
+    def to_emf(self) -> Dict[str, Any]:
+        """
+        Formats the metrics as a CloudWatch EMF log record (see `emf_record`).
+        """
+        summary = self.as_dict()
+        metrics = {
+            "TimeToFirstToken": (summary["time_to_first_token_ms"], "Milliseconds"),
+            "TotalTime": (summary["total_ms"], "Milliseconds"),
+            "ModelTime": (summary["model_ms"], "Milliseconds"),
+            "QueueTime": (summary["queue_ms"], "Milliseconds"),
+            "ToolTime": (summary["tool_ms"], "Milliseconds"),
+            "RetrievalTime": (summary["retrieval_ms"], "Milliseconds"),
+            "RetrievalResultSize": (summary["retrieval_result_chars"], "Count"),
+            "OutputTokensPerSecond": (summary["output_tokens_per_second"], "Count/Second"),
+            "InputTokens": (summary["input_tokens"], "Count"),
+            "OutputTokens": (summary["output_tokens"], "Count"),
+            "CacheReadInputTokens": (summary["cache_read_input_tokens"], "Count"),
+            "CacheWriteInputTokens": (summary["cache_write_input_tokens"], "Count"),
+            "ClientDisconnects": (int(summary["disconnected"]), "Count"),
+            # Only emitted for runs that prefetched, so its average is the hit rate
+            "PrefetchHit": (
+                int(self.prefetch_outcome == "hits") if self.prefetch_outcome else None,
+                "Count",
+            ),
+            "HistoryTokens": (summary["history_tokens"], "Count"),
+            "HistoryTurnsDropped": (summary["history_dropped_turns"], "Count"),
+            "SessionEvictions": (summary["session_evictions"], "Count"),
+            "SessionStoreSize": (summary["session_store_bytes"], "Bytes"),
+        }
+        return emf_record(
+            metrics,
+            # Kept as a plain property, so it's searchable in Logs Insights
+            properties={"ToolCalls": summary["tool_calls"]},
+        )
+
+
+def emf_record(
+    metrics: Dict[str, Tuple[Any, str]],
+    dimensions: Optional[Dict[str, str]] = None,
+    properties: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Formats metrics as a CloudWatch Embedded Metric Format log record.
+
+    Printing this record as a single JSON line from Lambda is enough for
+    CloudWatch to extract the metrics; no PutMetricData calls are needed.
+
+    See https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+
+    Args:
+        metrics: (value, unit) pairs by metric name. Metrics we couldn't
+            measure (a value of None) are left out.
+        dimensions: Dimensions besides the service, e.g. {"Client": ...}.
+        properties: Extra fields to log alongside the metrics.
+    """
+    metrics = {name: metric for name, metric in metrics.items() if metric[0] is not None}
+    dimensions = {"Service": "cabal-core", **(dimensions or {})}
+
+    return {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+        **dimensions,
+        **{name: value for name, (value, _) in metrics.items()},
+        **(properties or {}),
+    }
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
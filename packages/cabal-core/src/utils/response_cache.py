@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, List, Optional, Tuple
+from .sse import SSEEventType
+from .text import normalize_query
+from .tiered_cache import TieredCache
+
+# A recorded (event type, data) pair, in the order `generate_stream` emitted it
+RecordedEvent = Tuple[SSEEventType, Any]
+
+
+class ResponseCache:
+    """
+    An LRU cache of complete /chat responses, capped by entry count and size.
+
+    Since CABAL's model runs at temperature 0, the same message sent to the
+    same model with the same system prompt yields (near enough) the same
+    answer. We record the full ordered SSE event sequence of a response and
+    replay it for repeat messages, skipping both the model and the KB.
+
+    Entries are keyed on the normalized message, the model ID and a hash of
+    the system prompt, so changing either of the latter invalidates the cache.
+    They only live in memory (see `TieredCache`).
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        system_prompt: str,
+        max_entries: int = 512,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl_seconds: float = 24 * 3600,
+    ):
+        self.max_bytes = max_bytes
+
+        prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        self._prefix = f"{model_id}\x1f{prompt_hash}\x1f"
+
+        self._cache: TieredCache[List[RecordedEvent]] = TieredCache(
+            table="response_cache",
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            sizeof=_sizeof,
+            ttl_seconds=ttl_seconds,
+        )
+
+    def key(self, message: str) -> str:
+        """
+        Returns the cache key for a user message.
+        """
+        return hashlib.sha256(
+            (self._prefix + normalize_query(message)).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[List[RecordedEvent]]:
+        """
+        Returns the recorded events for a key, or None on a miss.
+        """
+        return self._cache.get(key)
+
+    def set(self, key: str, events: List[RecordedEvent]) -> None:
+        """
+        Stores the recorded events of a complete response.
+        """
+        # A single response bigger than the whole budget is never worth caching
+        if _sizeof(events) > self.max_bytes:
+            return
+        self._cache.set(key, events)
+
+
+def _sizeof(events: List[RecordedEvent]) -> int:
+    return sum(len(str(data)) for _, data in events)
+
+
+async def replay_events(
+    events: List[RecordedEvent],
+    chunk_chars: int = 0,
+    delay_seconds: float = 0.0,
+) -> AsyncIterator[RecordedEvent]:
+    """
+    Replays recorded events, optionally re-paced so the UI still animates.
+
+    When `chunk_chars` is set, consecutive MESSAGE events are merged and
+    re-split into chunks of that many characters, with `delay_seconds` between
+    chunks. Otherwise each run of MESSAGE events is replayed as a single event.
+
+    Args:
+        events: The recorded events of a cached response.
+        chunk_chars: Size of each replayed MESSAGE chunk, or 0 to disable pacing.
+        delay_seconds: Pause between paced MESSAGE chunks.
+    """
+    pending_text = []
+
+    async def flush() -> AsyncIterator[RecordedEvent]:
+        text = "".join(pending_text)
+        pending_text.clear()
+        if not text:
+            return
+        if not chunk_chars:
+            yield SSEEventType.MESSAGE, text
+            return
+        for start in range(0, len(text), chunk_chars):
+            if start and delay_seconds:
+                await asyncio.sleep(delay_seconds)
+            yield SSEEventType.MESSAGE, text[start:start + chunk_chars]
+
+    for event, data in events:
+        if event == SSEEventType.MESSAGE and isinstance(data, str):
+            pending_text.append(data)
+            continue
+        async for replayed in flush():
+            yield replayed
+        yield event, data
+
+    async for replayed in flush():
+        yield replayed
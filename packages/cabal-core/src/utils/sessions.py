@@ -0,0 +1,134 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from .text import estimate_tokens
+from .tiered_cache import TieredCache
+
+# A single message in a session's history: ("user" | "assistant", text)
+Turn = Tuple[str, str]
+
+# How many of the latest dropped questions we quote, and how much of each,
+# when summarizing turns that fell out of the history window
+SUMMARY_MAX_QUESTIONS = 10
+SUMMARY_QUESTION_CHARS = 120
+
+
+class SessionStore:
+    """
+    Conversation histories for multi-turn /chat sessions.
+
+    We only keep what the model needs to follow the conversation: the user's
+    messages and CABAL's final answers. Tool calls and retrieved passages are
+    left out, since they dwarf the answers and can simply be looked up again.
+
+    Histories are kept in a `TieredCache`, capped both by session count and
+    by total size in memory. With a `db_path`, sessions are also kept in
+    SQLite after they've been evicted from memory, and `get` and `append`
+    may block on it.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        max_turns: int = 40,
+        ttl_seconds: float = 3600,
+        db_path: Optional[str] = None,
+    ):
+        self.max_turns = max_turns
+        self._cache: TieredCache[List[Turn]] = TieredCache(
+            table="session_histories",
+            max_entries=max_sessions,
+            max_bytes=max_bytes,
+            sizeof=_sizeof,
+            ttl_seconds=ttl_seconds,
+            db_path=db_path,
+            dumps=lambda turns: json.dumps(turns, ensure_ascii=False),
+            loads=lambda value: [tuple(turn) for turn in json.loads(value)],
+        )
+
+    @property
+    def persistent(self) -> bool:
+        return self._cache.persistent
+
+    def get_memory(self, session_id: str) -> Optional[List[Turn]]:
+        """
+        Returns a session's history if it's in memory, or None if it isn't.
+        Never blocks on I/O.
+        """
+        turns = self._cache.get_memory(session_id)
+        return list(turns) if turns is not None else None
+
+    def get(self, session_id: str) -> List[Turn]:
+        """
+        Returns a session's history, oldest turn first. Unknown or expired
+        sessions have an empty history.
+        """
+        return list(self._cache.get(session_id) or [])
+
+    def append(self, session_id: str, turns: List[Turn]) -> int:
+        """
+        Adds turns to the end of a session's history, keeping at most
+        `max_turns` of the most recent ones.
+
+        Returns the number of sessions this pushed out of memory.
+        """
+        history = (self.get(session_id) + turns)[-self.max_turns:]
+
+        # Always start on a user turn, so the window never opens mid-exchange
+        while history and history[0][0] != "user":
+            history.pop(0)
+
+        return self._cache.set(session_id, history)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+def _sizeof(turns: List[Turn]) -> int:
+    return sum(len(text.encode("utf-8")) for _, text in turns)
+
+
+def window_history(history: List[Turn], max_tokens: int) -> Tuple[List[Turn], List[Turn]]:
+    """
+    Splits a history into the recent turns that fit in `max_tokens` and the
+    older turns that don't.
+
+    Turns are kept in whole user/assistant exchanges, newest first, so the
+    window always starts with a user turn (as Bedrock requires).
+    """
+    exchanges: List[List[Turn]] = []
+    for turn in history:
+        if turn[0] == "user" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(turn)
+
+    kept: List[List[Turn]] = []
+    remaining = max_tokens
+    for exchange in reversed(exchanges):
+        tokens = sum(estimate_tokens(text) for _, text in exchange)
+        if tokens > remaining:
+            break
+        kept.insert(0, exchange)
+        remaining -= tokens
+
+    dropped = exchanges[:len(exchanges) - len(kept)]
+    return [turn for exchange in kept for turn in exchange], [turn for exchange in dropped for turn in exchange]
+
+
+def summarize_turns(turns: List[Turn]) -> str:
+    """
+    A compact, extractive stand-in for turns that fell out of the window.
+
+    We list what the user asked about rather than asking the model for a
+    summary, which would cost an extra model call on the critical path.
+    """
+    questions = []
+    for role, text in turns:
+        if role != "user":
+            continue
+        text = " ".join(text.split())
+        questions.append(text if len(text) <= SUMMARY_QUESTION_CHARS else text[:SUMMARY_QUESTION_CHARS].rsplit(" ", 1)[0] + "...")
+
+    if not questions:
+        return ""
+    return "[Earlier in this session, the Commander asked: " + " | ".join(questions[-SUMMARY_MAX_QUESTIONS:]) + "]"
@@ -0,0 +1,152 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Optional, Tuple
+from .sse import SSEEventType, encode_sse
+
+
+class StreamGap(Exception):
+    """
+    Raised when a reader asks for events that have already left the buffer.
+    """
+
+
+class StreamBuffer:
+    """
+    The events of a single agent run, kept in a bounded ring buffer.
+
+    The run appends events as it produces them, and any number of readers tail
+    the buffer from a given position. Every event gets an ID of the form
+    `<stream ID>:<sequence number>`, which clients send back in the
+    `Last-Event-ID` header to pick up from where they dropped off.
+
+    With `max_events` set, the oldest events are evicted once the buffer is
+    full, whether or not they were read; that's only safe for resumable
+    streams, whose readers can come back and find out what they missed. A
+    stream that a single live reader follows should be left unbounded (None),
+    so a reader that falls behind just catches up later instead of losing
+    events.
+
+    The task producing the events can be attached as `producer`. It keeps
+    running while nobody is reading, but only for a grace period (see
+    `release`), so a client that never comes back doesn't cost a whole run.
+    """
+
+    def __init__(self, max_events: Optional[int] = None):
+        self.stream_id = uuid.uuid4().hex
+        self.finished_at: Optional[float] = None
+        self.readers = 0
+        self.producer: "Optional[asyncio.Task[Any]]" = None
+        self._events: "deque[Tuple[int, bytes]]" = deque(maxlen=max_events)
+        self._next_seq = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def append(self, data: Any, event: SSEEventType) -> None:
+        seq = self._next_seq
+        self._next_seq += 1
+        self._events.append((seq, encode_sse(data, event=event, id=f"{self.stream_id}:{seq}")))
+        self._notify()
+
+    def finish(self) -> None:
+        if not self.finished:
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def release(self, grace_seconds: float) -> None:
+        """
+        Called when a reader goes away. If nobody else is reading, the producer
+        is cancelled, either right away or after `grace_seconds` if no reader
+        has turned up by then.
+        """
+        if grace_seconds <= 0:
+            self._cancel_if_unread()
+        else:
+            asyncio.get_running_loop().call_later(grace_seconds, self._cancel_if_unread)
+
+    def _cancel_if_unread(self) -> None:
+        if self.readers == 0 and self.producer and not self.producer.done():
+            self.producer.cancel()
+
+    def _notify(self) -> None:
+        # Readers wait on the current event, so we wake them all and start a new one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def tail(self, after: int = -1) -> AsyncIterator[bytes]:
+        """
+        Yields every event after sequence number `after`, then follows the
+        run live until it finishes.
+
+        Raises `StreamGap` if some of the requested events were already
+        pushed out of the buffer.
+        """
+        next_seq = after + 1
+        self.readers += 1
+        try:
+            while True:
+                changed = self._changed
+                if self._events and self._events[0][0] > next_seq:
+                    raise StreamGap(f"Events before {self._events[0][0]} are no longer buffered")
+
+                # Snapshot first, since the run may append while we're yielding
+                pending = [(seq, payload) for seq, payload in self._events if seq >= next_seq]
+                for seq, payload in pending:
+                    next_seq = seq + 1
+                    yield payload
+
+                if next_seq >= self._next_seq:
+                    if self.finished:
+                        return
+                    await changed.wait()
+        finally:
+            self.readers -= 1
+
+
+class StreamRegistry:
+    """
+    Recent streams on this worker, looked up by the ID their events carry.
+
+    Finished streams stay resumable for `ttl_seconds`. If there are more than
+    `max_streams`, the oldest are forgotten first.
+    """
+
+    def __init__(self, max_events: int, max_streams: int, ttl_seconds: float):
+        self.max_events = max_events
+        self.max_streams = max_streams
+        self.ttl_seconds = ttl_seconds
+        self._streams: "OrderedDict[str, StreamBuffer]" = OrderedDict()
+
+    def create(self) -> StreamBuffer:
+        self._prune()
+        stream = StreamBuffer(max_events=self.max_events)
+        self._streams[stream.stream_id] = stream
+        while len(self._streams) > self.max_streams:
+            self._streams.popitem(last=False)
+        return stream
+
+    def resolve(self, last_event_id: str) -> Tuple[Optional[StreamBuffer], int]:
+        """
+        Returns the stream a `Last-Event-ID` belongs to (or None if it's
+        unknown or expired), along with the sequence number to resume after.
+        """
+        self._prune()
+        stream_id, _, seq = last_event_id.strip().rpartition(":")
+        try:
+            after = int(seq)
+        except ValueError:
+            return None, -1
+        return self._streams.get(stream_id), after
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        expired = [
+            stream_id for stream_id, stream in self._streams.items()
+            if stream.finished and now - stream.finished_at > self.ttl_seconds
+        ]
+        for stream_id in expired:
+            del self._streams[stream_id]
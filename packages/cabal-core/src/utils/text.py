@@ -0,0 +1,62 @@
+import math
+import re
+from typing import Any, List
+
+# Rough characters-per-token ratio for English text, good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+# Words that carry no signal for keyword matching
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the "
+    "this to was were what when where which who why will with".split()
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['.][a-z0-9]+)*")
+
+# Standard Okapi BM25 parameters, for every keyword scorer we have
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query so that trivially different phrasings share a cache entry
+    (e.g. "What is a Cyborg?" and "what is a  cyborg").
+    """
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip(" ?!.,;:")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lowercase word tokens, dropping stopwords.
+
+    Dotted and apostrophised words are kept whole so that proper nouns like
+    "Mk. II" or "Hassan's" still match across documents.
+    """
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+def bm25_idf(document_frequency: int, total_documents: int) -> float:
+    """
+    Returns the BM25 IDF of a term found in `document_frequency` of
+    `total_documents` documents. Rarer terms weigh more, and the weight never
+    drops below 0, even for terms found in every document.
+    """
+    return math.log(1 + (total_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def bm25_term_weight(term_frequency: Any, document_length: Any, avg_document_length: float) -> Any:
+    """
+    Returns BM25's saturated, length-normalized term frequency, to be
+    multiplied by the term's IDF. Works element-wise on NumPy arrays too.
+    """
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * document_length / avg_document_length)
+    return term_frequency * (BM25_K1 + 1) / (term_frequency + norm)
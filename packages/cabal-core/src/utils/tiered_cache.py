@@ -0,0 +1,226 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+from .metrics import emf_record
+
+V = TypeVar("V")
+
+
+class TieredCache(Generic[V]):
+    """
+    An in-process LRU with a TTL, backed by an optional SQLite tier.
+
+    The in-memory tier is capped by entry count and, given a `sizeof`, by
+    total size. The SQLite tier is a single table which, when placed on /tmp,
+    survives across warm Lambda invocations of the same execution environment
+    (and keeps entries the LRU evicted). Its entries are scoped to a
+    namespace, so moving to a new one (see `invalidate`) orphans the old ones.
+
+    Each tier has its own lock, and the in-memory one is never held across
+    SQLite I/O: `get_memory` never blocks on I/O and is safe to call from the
+    event loop, while `get` and `set` touch SQLite when it's enabled.
+
+    Every cache registers itself under its table name, so that its counters
+    are logged along with each request (see `drain_cache_metrics`).
+    """
+
+    def __init__(
+        self,
+        table: str,
+        max_entries: int,
+        ttl_seconds: float,
+        max_bytes: int = 0,
+        sizeof: Callable[[V], int] = lambda value: 0,
+        db_path: Optional[str] = None,
+        namespace: str = "",
+        dumps: Callable[[V], str] = json.dumps,
+        loads: Callable[[str], V] = json.loads,
+    ):
+        self.table = table
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+        self._sizeof = sizeof
+        self._dumps = dumps
+        self._loads = loads
+
+        # Entries come in from worker threads as well as the event loop
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, int, V]]" = OrderedDict()
+        self._size = 0
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0}
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "namespace TEXT, key TEXT, value TEXT, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute(f"DELETE FROM {table} WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+        with _registry_lock:
+            _caches[table] = self
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def get_memory(self, key: str) -> Optional[V]:
+        """
+        Returns the value for a key from the in-memory tier only, or None if
+        it isn't there. Never blocks on I/O.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry[2]
+            return None
+
+    def get(self, key: str) -> Optional[V]:
+        """
+        Returns the value for a key from either tier, or None on a miss. May
+        block on SQLite, so it's best called off the event loop.
+        """
+        value = self.get_memory(key)
+        if value is not None:
+            return value
+
+        namespace = self.namespace
+        value = self._get_persistent(namespace, key)
+
+        with self._lock:
+            # Entries read before an `invalidate` belong to the old namespace
+            if value is not None and namespace == self.namespace:
+                # Promote to the in-memory tier so the next hit skips SQLite
+                self._set_memory(key, value)
+                self._counters["persistent_hits"] += 1
+                return value
+
+            self._counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: V) -> int:
+        """
+        Stores a value in every enabled tier. Returns the number of entries
+        this pushed out of memory.
+        """
+        with self._lock:
+            namespace = self.namespace
+            evictions = self._counters["evictions"]
+            self._set_memory(key, value)
+            evictions = self._counters["evictions"] - evictions
+        self._set_persistent(namespace, key, value)
+        return evictions
+
+    def invalidate(self, namespace: str) -> None:
+        """
+        Moves the cache to a new namespace, dropping every entry in both tiers.
+        """
+        with self._lock:
+            self.namespace = namespace
+            self._entries.clear()
+            self._size = 0
+        if self._db:
+            with self._db_lock:
+                self._db.execute(f"DELETE FROM {self.table} WHERE namespace != ?", (namespace,))
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns hit/miss/eviction counters since the last drain along with
+        the in-memory size.
+        """
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "bytes": self._size}
+
+    def drain(self) -> Dict[str, Any]:
+        """
+        Returns the same as `stats`, and resets the counters.
+        """
+        with self._lock:
+            stats = {**self._counters, "entries": len(self._entries), "bytes": self._size}
+            self._counters = {name: 0 for name in self._counters}
+            return stats
+
+    def _set_memory(self, key: str, value: V) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= entry[1]
+
+        size = self._sizeof(value)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+        self._size += size
+
+        # The entry we just set is the most recent one, so it's never evicted here
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes and self._size > self.max_bytes and len(self._entries) > 1
+        ):
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+            self._counters["evictions"] += 1
+
+    def _get_persistent(self, namespace: str, key: str) -> Optional[V]:
+        if not self._db:
+            return None
+
+        # The persistent tier outlives the process, so we compare against wall-clock time
+        with self._db_lock:
+            row = self._db.execute(
+                f"SELECT value FROM {self.table} WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time()),
+            ).fetchone()
+        return self._loads(row[0]) if row else None
+
+    def _set_persistent(self, namespace: str, key: str, value: V) -> None:
+        if not self._db:
+            return
+
+        serialized = self._dumps(value)
+        with self._db_lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, serialized, time.time() + self.ttl_seconds),
+            )
+            self._db.commit()
+
+
+_caches: Dict[str, TieredCache] = {}
+_registry_lock = threading.Lock()
+
+
+def drain_cache_metrics() -> List[Dict[str, Any]]:
+    """
+    Formats each cache's counters since the last call as a CloudWatch EMF
+    record, with the cache's table as a dimension. Caches that weren't used
+    since then are left out.
+    """
+    with _registry_lock:
+        caches = dict(_caches)
+
+    records = []
+    for table, cache in caches.items():
+        summary = cache.drain()
+        if not summary["memory_hits"] + summary["persistent_hits"] + summary["misses"]:
+            continue
+        records.append(emf_record(
+            {
+                "CacheMemoryHits": (summary["memory_hits"], "Count"),
+                "CachePersistentHits": (summary["persistent_hits"], "Count"),
+                "CacheMisses": (summary["misses"], "Count"),
+                "CacheEvictions": (summary["evictions"], "Count"),
+                "CacheEntries": (summary["entries"], "Count"),
+                "CacheSize": (summary["bytes"] if cache.max_bytes else None, "Bytes"),
+            },
+            dimensions={"Cache": table},
+        ))
+    return records
@@ -0,0 +1,39 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class TokenUsage:
+    """
+    Token counts accumulated across every model turn of a single agent run.
+
+    Bedrock reports prompt cache reads and writes separately from regular
+    input tokens, which lets us check that the persona prefix is actually
+    being served from the cache.
+    """
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_write_input_tokens: int = 0
+    model_turns: int = 0
+
+    def add(self, usage_metadata: Optional[Dict[str, Any]]) -> None:
+        """
+        Adds the `usage_metadata` of a single model response.
+        """
+        if not usage_metadata:
+            return
+
+        details = usage_metadata.get("input_token_details") or {}
+        cache_read = details.get("cache_read") or 0
+        cache_write = details.get("cache_creation") or 0
+
+        # LangChain folds cached tokens into `input_tokens`; we report the uncached share
+        self.input_tokens += usage_metadata.get("input_tokens", 0) - cache_read - cache_write
+        self.output_tokens += usage_metadata.get("output_tokens", 0)
+        self.cache_read_input_tokens += cache_read
+        self.cache_write_input_tokens += cache_write
+        self.model_turns += 1
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
@@ -38,6 +38,9 @@ export class CabalComputeStack extends cdk.Stack {
         // See Dockerfile in cabal-core for details
         AWS_LWA_INVOKE_MODE: "RESPONSE_STREAM",
         AWS_LWA_PORT: "8080",
+        // LWA polls this path until it succeeds before routing any requests,
+        // which doubles as our agent warm-up hook
+        AWS_LWA_READINESS_CHECK_PATH: "/ready",
         // Environment variables for CABAL agent code
         KNOWLEDGE_BASE_ID: nodKBId,
         // We define the Bedrock model we'll be using. Some notes:
@@ -45,6 +48,9 @@ export class CabalComputeStack extends cdk.Stack {
         // - We pick Claude Haiku over Sonnet for cost efficiency since
         //   CABAL may receive higher volume as a chatbot
         MODEL_ID: "us.anthropic.claude-3-5-haiku-20241022-v1:0",
+        // Build the agent in the background while uvicorn boots, rather
+        // than at import time
+        CABAL_STARTUP_MODE: "background",
       },
     });
 
@@ -83,7 +89,12 @@ export class CabalComputeStack extends cdk.Stack {
     cabalCore.addToRolePolicy(
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
-        actions: ["bedrock:Retrieve"],
+        // Listing ingestion jobs lets CABAL drop cached lookups after a KB sync
+        actions: [
+          "bedrock:Retrieve",
+          "bedrock:ListDataSources",
+          "bedrock:ListIngestionJobs",
+        ],
         resources: [
           `arn:aws:bedrock:${this.region}:${this.account}:knowledge-base/${nodKBId}`,
         ],